@@ -0,0 +1,171 @@
+"""
+Contrôle d'admission de /answer : nombre borné de requêtes en cours dans le
+worker, file d'attente bornée avec une date limite par requête, et limite de
+concurrence adaptée à la latence observée.
+
+Quand Gemini ou Cloud SQL ralentit, le temps de service augmente : la limite
+baisse (décroissance multiplicative), la file se remplit et les requêtes qui
+ne peuvent plus être servies à temps sont refusées tout de suite (503 avec
+Retry-After) au lieu de s'accumuler jusqu'au délai du client. La limite
+remonte d'une place par « aller-retour » complet tant que la latence reste
+sous la cible (AIMD).
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class OverloadedError(Exception):
+    """La requête ne peut pas être servie dans les délais : à renvoyer en 503 avec Retry-After."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Places de traitement du worker et file d'attente devant elles.
+
+    Args:
+        initial_limit (int): Limite de concurrence au démarrage.
+        min_limit (int): Limite plancher.
+        max_limit (int): Limite plafond.
+        max_queue (int): Requêtes en attente au plus ; au-delà, refus immédiat.
+        queue_timeout (float): Attente maximale d'une place (date limite de chaque requête, secondes).
+        latency_target (float): Temps de service au-delà duquel la limite baisse (secondes).
+        backoff (float): Facteur appliqué à la limite quand la latence dépasse la cible.
+        overload_window (float): Durée de l'état de surcharge après un refus (secondes).
+    """
+
+    def __init__(self, initial_limit: int = 32, min_limit: int = 4, max_limit: int = 128, max_queue: int = 64,
+                 queue_timeout: float = 5.0, latency_target: float = 10.0, backoff: float = 0.9,
+                 overload_window: float = 10.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.overload_window = overload_window
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self.latency = 0.0  # moyenne glissante du temps de service (secondes)
+        self._queue = deque()  # futures des requêtes en attente, dans l'ordre d'arrivée
+        self._last_decrease = 0.0
+        self._overloaded_until = 0.0
+        # degraded et joined sont tenus par l'API : réponses de surcharge et requêtes admises sans place
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0, "degraded": 0, "joined": 0}
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def overloaded(self) -> bool:
+        """
+        Requêtes en attente, ou refus récent : les réponses sans LLM sont servies sans passer par la file.
+        """
+        return bool(self._queue) or time.monotonic() < self._overloaded_until
+
+    def retry_after(self) -> float:
+        # Temps estimé pour écouler la file actuelle, au moins une seconde
+        return max(1.0, (len(self._queue) + 1) * self.latency / self.capacity)
+
+    def _reject(self, reason: str, counter: str = "rejected"):
+        self.counters[counter] += 1
+        self._overloaded_until = time.monotonic() + self.overload_window
+        raise OverloadedError(reason, self.retry_after())
+
+    async def acquire(self) -> float:
+        """
+        Attend une place et retourne l'instant d'admission, à rendre à `release`.
+        Lève OverloadedError si la file est pleine, si l'attente estimée dépasse la
+        date limite ou si aucune place ne se libère avant elle.
+        """
+        if self.in_flight < self.capacity and not self._queue:
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+            return time.monotonic()
+        if len(self._queue) >= self.max_queue:
+            self._reject("File d'attente pleine")
+        # Attente prévisible au-delà de la date limite : refus immédiat plutôt qu'après queue_timeout
+        if (len(self._queue) + 1) * self.latency / self.capacity > self.queue_timeout:
+            self._reject("Attente estimée au-delà du délai")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append(future)
+        self.counters["queued"] += 1
+        try:
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Place attribuée au moment de l'abandon : rendue aux suivants
+                self.in_flight -= 1
+                self._wake()
+            elif future in self._queue:
+                self._queue.remove(future)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("Délai d'attente dépassé", counter="timeouts")
+            raise
+        self.counters["admitted"] += 1
+        return time.monotonic()
+
+    def release(self, admitted_at: float, timed_out: bool = False):
+        """
+        Rend la place et ajuste la limite au temps de service de la requête.
+
+        Args:
+            admitted_at (float): Valeur retournée par `acquire`.
+            timed_out (bool): La requête a échoué sur un délai d'un service amont.
+        """
+        latency = time.monotonic() - admitted_at
+        self.in_flight -= 1
+        self.latency = latency if not self.latency else 0.9 * self.latency + 0.1 * latency
+        if timed_out or latency > self.latency_target:
+            # Une seule baisse par fenêtre : les requêtes admises avant la dernière baisse n'en déclenchent pas d'autre
+            if admitted_at >= self._last_decrease:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = time.monotonic()
+        elif self._queue or self.in_flight + 1 >= self.capacity:
+            # Limite atteinte et latence sous la cible : une place de plus par aller-retour complet
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def _wake(self):
+        # Places libres attribuées aux requêtes en attente, dans l'ordre d'arrivée
+        while self._queue and self.in_flight < self.capacity:
+            future = self._queue.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Place tenue pendant le bloc ; un asyncio.TimeoutError du bloc compte comme signal de surcharge.
+        """
+        admitted_at = await self.acquire()
+        timed_out = False
+        try:
+            yield
+        except asyncio.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.release(admitted_at, timed_out)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "limit": self.capacity,
+            "in_flight": self.in_flight,
+            "queued_now": len(self._queue),
+            "latency": self.latency,
+            "overloaded": self.overloaded(),
+        }
+
+
+def retry_after_header(e: OverloadedError) -> str:
+    return str(math.ceil(e.retry_after))
@@ -1,190 +1,958 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from pydantic import BaseModel
-from typing import List
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
+from typing import List, Optional
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
-import google.generativeai as genai
-from ingest import create_cloud_sql_database_connection, get_embeddings, get_vector_store
-from retrieve import get_relevant_documents, format_relevant_documents
-from config import TABLE_NAME
+import asyncio
+import time
+import json
+from collections import deque
+from ingest import create_cloud_sql_database_connection_async, get_cached_embeddings, get_vector_store_async, awarm_connection_pool
+from retrieve import (
+    get_relevant_documents, format_relevant_documents, document_id, asearch_hybrid, lexical_match, metadata_filter,
+    matches_filter
+)
+from response_cache import create_response_cache
+from vector_index import InMemoryVectorIndex
+from question_index import QuestionIndex, aload_question_index
+from lexical_index import BM25Index
+from translations import TranslationStore, normalize_language
+from session_store import create_session_store
+from llm_gateway import LLMGateway, CircuitBreaker
+import metrics
+from metrics import RequestTimer, timed
+from history import HistoryBuilder
+from singleflight import SingleFlight
+from admission import AdmissionController, OverloadedError, retry_after_header
+from text_utils import normalize_question
+from config import (
+    TABLE_NAME, RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_PATH, RETRIEVAL_ENGINE, VECTOR_INDEX_MAX_AGE,
+    SESSION_STORE_BACKEND, SESSION_STORE_PATH, SESSION_MAX_MESSAGES, SESSION_MAX_SESSIONS, SESSION_IDLE_TTL,
+    BATCH_MAX_SIZE, BATCH_LLM_CONCURRENCY, WARMUP_DB_CONNECTIONS, WARMUP_QUESTION,
+    LLM_MODEL, LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_MAX_CONCURRENCY,
+    LLM_BREAKER_FAILURES, LLM_BREAKER_RESET, USE_QUESTION_INDEX, QUESTION_INDEX_PATH,
+    SIMILARITY_THRESHOLD, INFER_FOCUS_FILTER, HISTORY_TOKEN_BUDGET, HISTORY_SUMMARY_MAX_WORDS,
+    EXTRACTIVE_MATCH_SCORE, CORPUS_LANGUAGE, USE_TRANSLATIONS, TRANSLATIONS_TABLE, USE_LEXICAL_INDEX, COALESCE_REQUESTS,
+    USE_ADMISSION_CONTROL, ADMISSION_INITIAL_LIMIT, ADMISSION_MIN_LIMIT, ADMISSION_MAX_LIMIT, ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT, ADMISSION_LATENCY_TARGET, ADMISSION_BACKOFF, ADMISSION_OVERLOAD_WINDOW
+)
 from uuid import uuid4
 
 load_dotenv()
 API_KEY = os.getenv('API_KEY')
-genai.configure(api_key=API_KEY)
-conversation_history = {}
+# Historique des conversations, borné en messages, en sessions et en durée d'inactivité
+session_store = create_session_store(
+    SESSION_STORE_BACKEND,
+    path=SESSION_STORE_PATH,
+    max_messages=SESSION_MAX_MESSAGES,
+    max_sessions=SESSION_MAX_SESSIONS,
+    idle_ttl=SESSION_IDLE_TTL
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Le préchauffage tourne en arrière-plan : /ready ne répond 200 qu'une fois terminé
+    warmup_task = asyncio.create_task(warm_up())
+    yield
+    warmup_task.cancel()
+    save_caches()
 
 app = FastAPI(
     title="SorakaBot API",
     description="API pour l'assistant médical SorakaBot",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 class UserInput(BaseModel):
     question: str
     temperature: float
     language: str
-    session_id: str = ""  # Identifiant de session
-    previous_context: List[dict] = []
+    session_id: str = ""  # Identifiant de session : l'historique est conservé côté serveur
+    focus_area: str = ""  # Filtre optionnel de la recherche (domaine médical)
+    source: str = ""  # Filtre optionnel de la recherche (source)
+    timings: bool = False  # Renvoyer la durée de chaque étape dans metadata
+
+def get_llm(temperature: float = 0.3, model: str = LLM_MODEL):
+    # Import différé : le client Gemini est lourd à importer et inutile avant la première génération
+    from langchain_google_genai import ChatGoogleGenerativeAI
 
-def get_llm(temperature: float = 0.3):
     return ChatGoogleGenerativeAI(
-        model="gemini-1.5-pro",
+        model=model,
         google_api_key=API_KEY,
         temperature=temperature,
+        max_retries=1,  # les nouvelles tentatives sont gérées par la passerelle
         verbose=True
     )
 
+# Clients réutilisés, délai, nouvelles tentatives, concurrence et disjoncteur pour tous les appels LLM
+llm_gateway = LLMGateway(
+    client_factory=get_llm,
+    model=LLM_MODEL,
+    timeout=LLM_TIMEOUT,
+    max_retries=LLM_MAX_RETRIES,
+    backoff_base=LLM_BACKOFF_BASE,
+    backoff_max=LLM_BACKOFF_MAX,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+)
+
+async def summarize_history(summary: str, messages_text: str) -> str:
+    return await llm_gateway.ainvoke("summary", 0.0, {
+        "summary": summary or "Aucun résumé pour l'instant.",
+        "messages": messages_text,
+        "max_words": HISTORY_SUMMARY_MAX_WORDS
+    })
+
+# Historique des prompts borné en tokens, tours anciens résumés en arrière-plan
+history_builder = HistoryBuilder(session_store, summarize_history, token_budget=HISTORY_TOKEN_BUDGET)
+
 
 # Initialisation des connexions aux services
 engine = None
 embedding = None
 vector_store = None
+vector_index = None
+_vector_index_refresh = None
+question_index = None
+lexical_index = None
+translation_store = None
+response_cache = create_response_cache(RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_PATH)
+_init_lock = asyncio.Lock()
+services_ready = False
+startup_timing = {}
+# Latences perçues du streaming, sur les 1000 dernières requêtes
+streaming_latency = {"time_to_first_token": deque(maxlen=1000), "total": deque(maxlen=1000)}
+# Requêtes concurrentes identiques sans historique : un seul embedding, une seule recherche, un seul appel LLM
+inflight = SingleFlight() if COALESCE_REQUESTS else None
+# Places de traitement et file d'attente de /answer et /answer/stream
+admission = AdmissionController(
+    initial_limit=ADMISSION_INITIAL_LIMIT,
+    min_limit=ADMISSION_MIN_LIMIT,
+    max_limit=ADMISSION_MAX_LIMIT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    latency_target=ADMISSION_LATENCY_TARGET,
+    backoff=ADMISSION_BACKOFF,
+    overload_window=ADMISSION_OVERLOAD_WINDOW
+) if USE_ADMISSION_CONTROL else None
+# Latences par niveau de réponse (extractive, combined, llm), sur les 1000 dernières requêtes
+tier_latency = {tier: deque(maxlen=1000) for tier in ("extractive_response", "combined_response", "llm_response")}
 
-def ensure_services_initialized():
+async def ensure_services_initialized():
     global engine, embedding, vector_store
-    if vector_store is None:
-        try:
-            engine = create_cloud_sql_database_connection()
-            embedding = get_embeddings()
-            vector_store = get_vector_store(engine, TABLE_NAME, embedding)
-        except Exception as e:
-            print(f"Erreur d'initialisation des services: {str(e)}")
-            raise
+    if vector_store is not None:
+        return
+    # Un seul initialiseur à la fois : les requêtes concurrentes attendent le premier
+    async with _init_lock:
+        if vector_store is None:
+            try:
+                # Connexion Cloud SQL et service d'embedding en parallèle ; la construction
+                # du client Vertex fait des appels d'authentification bloquants
+                engine, embedding = await asyncio.gather(
+                    create_cloud_sql_database_connection_async(),
+                    asyncio.to_thread(get_cached_embeddings)
+                )
+                vector_store = await get_vector_store_async(engine, TABLE_NAME, embedding)
+            except Exception as e:
+                print(f"Erreur d'initialisation des services: {str(e)}")
+                raise
+
+
+async def warm_up():
+    """
+    Initialise les services puis, en parallèle, ouvre les connexions du pool, charge
+    les index en mémoire et exécute un embedding et une recherche factices.
+    """
+    global services_ready
+    start = time.perf_counter()
+    try:
+        await ensure_services_initialized()
+        startup_timing["services_initialized"] = time.perf_counter() - start
+        tasks = [awarm_connection_pool(engine, WARMUP_DB_CONNECTIONS), warm_search()]
+        if RETRIEVAL_ENGINE == "memory":
+            tasks.append(refresh_vector_index())
+        if USE_QUESTION_INDEX:
+            tasks.append(refresh_question_index(QUESTION_INDEX_PATH))
+        if USE_LEXICAL_INDEX:
+            tasks.append(refresh_lexical_index())
+        if USE_TRANSLATIONS:
+            tasks.append(refresh_translations())
+        await asyncio.gather(*tasks)
+        startup_timing["time_to_ready"] = time.perf_counter() - start
+        services_ready = True
+        print(f"Services prêts en {startup_timing['time_to_ready']:.2f}s")
+    except Exception as e:
+        print(f"Erreur de préchauffage des services: {str(e)}")
+
+
+async def warm_search():
+    query_embedding = await embedding.aembed_query(WARMUP_QUESTION)
+    await vector_store.asimilarity_search_with_score_by_vector(query_embedding, k=1)
+
+
+async def refresh_vector_index():
+    """
+    (Re)charge l'index vectoriel en mémoire ; en cas d'échec les recherches passent par Postgres.
+    """
+    global vector_index
+    try:
+        vector_index = await InMemoryVectorIndex.aload(engine, TABLE_NAME, max_age=VECTOR_INDEX_MAX_AGE)
+        print(f"Index vectoriel en mémoire chargé : {len(vector_index)} documents")
+    except Exception as e:
+        print(f"Erreur de chargement de l'index vectoriel: {str(e)}")
+
+
+async def refresh_question_index(path: str = None):
+    """
+    (Re)charge l'index exact des questions, depuis le fichier d'ingestion s'il est donné et existe,
+    sinon depuis la table ; en cas d'échec toutes les questions passent par l'embedding.
+    """
+    global question_index
+    try:
+        if path:
+            question_index = await aload_question_index(engine, TABLE_NAME, path)
+        else:
+            question_index = await QuestionIndex.aload(engine, TABLE_NAME)
+        print(f"Index des questions chargé : {len(question_index)} questions")
+    except Exception as e:
+        print(f"Erreur de chargement de l'index des questions: {str(e)}")
+
+
+async def refresh_lexical_index():
+    """
+    (Re)construit l'index BM25 depuis la table ; en cas d'échec la recherche reste purement vectorielle.
+    """
+    global lexical_index
+    try:
+        lexical_index = await BM25Index.aload(engine, TABLE_NAME)
+        print(f"Index lexical chargé : {len(lexical_index)} documents, {len(lexical_index.vocabulary)} termes")
+    except Exception as e:
+        print(f"Erreur de chargement de l'index lexical: {str(e)}")
+
+
+async def refresh_translations():
+    """
+    (Re)charge les réponses pré-traduites ; en cas d'échec Gemini traduit à la volée.
+    """
+    global translation_store
+    try:
+        translation_store = await TranslationStore.aload(engine, TRANSLATIONS_TABLE)
+        print(f"Traductions chargées : {len(translation_store)} réponses")
+    except Exception as e:
+        print(f"Erreur de chargement des traductions: {str(e)}")
+
+
+def localized_answer(doc, language: str):
+    """
+    Réponse de référence dans la langue demandée : l'originale en anglais, sinon la traduction
+    pré-calculée si elle existe (None sinon).
+    """
+    language = normalize_language(language)
+    if language == CORPUS_LANGUAGE:
+        return doc.metadata['answer']
+    if translation_store is None:
+        return None
+    return translation_store.get(document_id(doc), language)
+
+
+def coalesce_key(history_text: str, *parts):
+    # Seules les requêtes sans historique sont regroupées : leur résultat ne dépend que de la question et des paramètres
+    if inflight is None or history_text:
+        return None
+    return parts
+
+
+async def coalesced(key, factory):
+    """
+    Résultat de `factory()`, partagé avec les requêtes concurrentes de même clé (None = pas de regroupement).
+    """
+    if key is None:
+        return await factory()
+    return await inflight.do(key, factory)
+
+
+def llm_coalesce_key(kind: str, user_input: UserInput, context: dict):
+    doc = context["doc"]
+    return coalesce_key(
+        context["history_text"], kind, normalize_question(user_input.question), user_input.language.casefold(),
+        user_input.temperature, document_id(doc) if doc is not None else ""
+    )
+
+
+def schedule_vector_index_refresh():
+    # Index périmé : rechargement en arrière-plan, les requêtes utilisent Postgres en attendant
+    global _vector_index_refresh
+    if vector_index is not None and vector_index.is_stale():
+        if _vector_index_refresh is None or _vector_index_refresh.done():
+            _vector_index_refresh = asyncio.create_task(refresh_vector_index())
+
+
+def combined_inputs(user_input: UserInput, doc, history_text: str, reference_answer: str = None) -> dict:
+    """
+    Variables du prompt de la branche combined_response (réponse de référence trouvée en base,
+    déjà dans la langue demandée si elle a été pré-traduite).
+    """
+    return {
+        "language": user_input.language,
+        "question": user_input.question,
+        "reference_answer": reference_answer or doc.metadata['answer'],
+        "history": history_text if history_text else "Pas d'historique précédent."
+    }
+
+
+def llm_inputs(user_input: UserInput, history_text: str) -> dict:
+    """
+    Variables du prompt de la branche llm_response (pas de bonne correspondance en base).
+    """
+    return {
+        "language": user_input.language,
+        "question": user_input.question,
+        "history": history_text if history_text else "Pas d'historique précédent."
+    }
+
+
+def combined_metadata(doc, score: Optional[float], lexical_score: float = None) -> dict:
+    # Correspondance lexicale : confiance BM25, sans distance cosinus (score None), exposée à part
+    metadata = {
+        "source": doc.metadata['source'],
+        "focus_area": doc.metadata['focus_area']
+    }
+    if score is not None:
+        metadata["similarity_score"] = f"{score:.4f}"
+    if lexical_score is not None:
+        metadata["lexical_score"] = f"{lexical_score:.4f}"
+    return metadata
+
+
+def _score_line(score: Optional[float], lexical_score: float = None) -> str:
+    if score is None:
+        return f"Score lexical : {lexical_score:.4f}"
+    return f"Score de similarité : {score:.4f}"
+
+
+def format_extractive_message(answer: str, doc, score: Optional[float], lexical_score: float = None) -> str:
+    return f"""{answer}
+
+Source : {doc.metadata['source']}
+Domaine médical : {doc.metadata['focus_area']}
+{_score_line(score, lexical_score)}"""
+
+
+def format_combined_message(response_content: str, doc, score: Optional[float], reference_answer: str = None,
+                            lexical_score: float = None) -> str:
+    return f"""Réponse: {response_content}
+
+Pour plus de détails :
+{reference_answer or doc.metadata['answer']}
+
+Source : {doc.metadata['source']}
+Domaine médical : {doc.metadata['focus_area']}
+{_score_line(score, lexical_score)}"""
+
+
+async def prepare_answer(user_input: UserInput, query_embedding: list[float] = None, timer: RequestTimer = None) -> dict:
+    """
+    Étapes communes à /answer et /answer/stream : session, historique, embedding et recherche.
+
+    Args:
+        user_input (UserInput): La requête.
+        query_embedding (list[float], optional): Embedding déjà calculé (lots), sinon calculé ici.
+        timer (RequestTimer, optional): Reçoit la durée de chaque étape de la requête.
+
+    Returns:
+        dict: type de réponse, document et score trouvés, historique formaté, clé de cache et timer.
+    """
+    await ensure_services_initialized()
+    # Gérer l'ID de session
+    if not user_input.session_id:
+        user_input.session_id = str(uuid4())
+    
+    with timed("session", timer):
+        # Ajouter la question actuelle à l'historique
+        await session_store.aappend(user_input.session_id, "user", user_input.question)
+
+        # Historique dans le budget de tokens, précédé du résumé des tours plus anciens
+        history = await session_store.aget_history(user_input.session_id)
+        meta = await session_store.aget_meta(user_input.session_id)
+        history_text = history_builder.build(user_input.session_id, history[:-1], meta)  # Exclure la question actuelle
+
+        # Filtre explicite, sinon domaine médical de la dernière bonne correspondance de la session
+        explicit_filter = metadata_filter(user_input.focus_area, user_input.source)
+        last_focus_area = meta.get("focus_area", "") if INFER_FOCUS_FILTER else ""
+        search_filter = explicit_filter or metadata_filter(last_focus_area)
+
+    # Question déjà présente en base : document retrouvé sans embedding ni recherche
+    exact_match = question_index.lookup(user_input.question) if question_index is not None else None
+    if exact_match is not None and matches_filter(exact_match, explicit_filter):
+        retrieval, results = "exact", [(exact_match, 0.0)]
+    else:
+        # BM25 sûr de lui (mots-clés d'une question du corpus) : ni embedding ni recherche vectorielle.
+        # Sa confiance n'est pas une distance cosinus : pas de score de similarité, seuil LEXICAL_MATCH_SCORE
+        lexical_hit = lexical_match(user_input.question, lexical_index, explicit_filter, timer)
+        if lexical_hit is not None:
+            retrieval, results = "lexical", [(lexical_hit[0], None)]
+        else:
+            retrieval = "hybrid" if lexical_index is not None else "vector"
+
+            async def search() -> list:
+                # Embedding et recherche vectorielle asynchrones : la boucle reste libre pendant les appels réseau
+                question_embedding = query_embedding
+                if question_embedding is None:
+                    with timed("embedding", timer):
+                        question_embedding = await embedding.aembed_query(user_input.question)
+                schedule_vector_index_refresh()
+                found = await asearch_hybrid(user_input.question, question_embedding, vector_store, k=1, index=vector_index,
+                                             lexical_index=lexical_index, filter=search_filter, timer=timer,
+                                             engine=engine)
+                if explicit_filter is None and search_filter is not None and not (found and found[0][1] < SIMILARITY_THRESHOLD):
+                    # Filtre déduit sans bonne correspondance : la conversation a changé de sujet
+                    found = await asearch_hybrid(user_input.question, question_embedding, vector_store, k=1, index=vector_index,
+                                                 lexical_index=lexical_index, timer=timer, engine=engine)
+                return found
+
+            results = await coalesced(coalesce_key(
+                history_text, "search", normalize_question(user_input.question), tuple(sorted((search_filter or {}).items()))
+            ), search)
+
+    context = {"type": "llm_response", "doc": None, "score": None, "lexical_score": None, "answer": None,
+               "history_text": history_text, "cache_key": None, "retrieval": retrieval, "timer": timer}
+    if results:
+        doc, score = results[0]
+        # Correspondance lexicale : déjà retenue par son propre seuil, jamais comparée aux distances cosinus
+        good_match = score is None or score < SIMILARITY_THRESHOLD
+        if score is None:
+            context["lexical_score"] = lexical_hit[1]
+        answer = localized_answer(doc, user_input.language) if good_match else None
+        # Une correspondance par mots-clés n'est jamais servie telle quelle : le LLM reformule
+        # Un seuil à 0 désactive le niveau : une auto-correspondance exacte peut donner une distance de -2e-16
+        if (EXTRACTIVE_MATCH_SCORE > 0 and score is not None and score < EXTRACTIVE_MATCH_SCORE
+                and not history_text and answer is not None):
+            # Correspondance quasi exacte, réponse disponible dans la langue demandée, sans conversation
+            # en cours : la réponse de référence est servie telle quelle, sans appel au LLM
+            context.update(type="extractive_response", doc=doc, score=score, answer=answer)
+        elif good_match:  # Bonne correspondance
+            context.update(type="combined_response", doc=doc, score=score, answer=answer)
+            # Même document, langue, température et historique : la réponse en cache évite l'appel à Gemini
+            context["cache_key"] = response_cache.make_key(
+                document_id(doc), user_input.language, user_input.temperature, user_input.question, history_text
+            )
+        if context["doc"] is not None and INFER_FOCUS_FILTER and doc.metadata.get("focus_area", "") != last_focus_area:
+            await session_store.aupdate_meta(user_input.session_id, focus_area=doc.metadata.get("focus_area", ""))
+    if metrics.enabled:
+        metrics.RESPONSES.labels(type=context["type"]).inc()
+        if context["doc"] is not None:
+            metrics.RETRIEVALS.labels(method=retrieval).inc()
+    return context
+
+
+async def degraded_context(user_input: UserInput) -> Optional[dict]:
+    """
+    Réponse de surcharge, sans embedding, recherche vectorielle ni LLM : réponse de référence
+    d'une question du corpus (index exact), sinon réponse déjà en cache pour un premier tour.
+    La réponse de référence est servie même en cours de conversation ou si le niveau
+    extractif est désactivé : elle vaut mieux qu'un 503. None si rien n'est disponible.
+    """
+    explicit_filter = metadata_filter(user_input.focus_area, user_input.source)
+    exact_match = question_index.lookup(user_input.question) if question_index is not None else None
+    if exact_match is not None and matches_filter(exact_match, explicit_filter):
+        doc, score, lexical_score = exact_match, 0.0, None
+    else:
+        lexical_hit = lexical_match(user_input.question, lexical_index, explicit_filter)
+        if lexical_hit is None:
+            return None
+        # Confiance BM25 exposée à part : ce n'est pas une distance cosinus
+        doc, score, lexical_score = lexical_hit[0], None, lexical_hit[1]
+
+    answer = localized_answer(doc, user_input.language)
+    context = {"doc": doc, "score": score, "lexical_score": lexical_score, "answer": answer, "cache_key": None,
+               "retrieval": "degraded"}
+    first_turn = not user_input.session_id or not await session_store.aget_history(user_input.session_id)
+    cached_response = await response_cache.aget(response_cache.make_key(
+        document_id(doc), user_input.language, user_input.temperature, user_input.question, ""
+    )) if first_turn else None
+    if exact_match is not None and answer is not None:
+        context.update(type="extractive_response", content=answer)
+    elif cached_response is not None:
+        context.update(type="combined_response", content=cached_response["content"])
+    else:
+        return None
+
+    if not user_input.session_id:
+        user_input.session_id = str(uuid4())
+    await session_store.aappend(user_input.session_id, "user", user_input.question)
+    await add_assistant_message(user_input.session_id, context["content"])
+    admission.counters["degraded"] += 1
+    if metrics.enabled:
+        metrics.RESPONSES.labels(type=context["type"]).inc()
+        metrics.ADMISSIONS.labels(outcome="degraded").inc()
+    return context
+
+
+OVERLOADED_MESSAGE = "Service surchargé, veuillez réessayer dans quelques instants."
+
+
+def overloaded_response(e: OverloadedError, endpoint: str = "answer") -> JSONResponse:
+    if metrics.enabled:
+        metrics.ADMISSIONS.labels(outcome="rejected").inc()
+        metrics.ERRORS.labels(endpoint=endpoint).inc()
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": retry_after_header(e)},
+        content={"message": OVERLOADED_MESSAGE, "error": str(e)}
+    )
+
+
+async def add_assistant_message(session_id: str, content: str):
+    # Ajouter la réponse à l'historique
+    await session_store.aappend(session_id, "assistant", content)
+
+
+def save_caches():
+    # Persister le cache d'embeddings pour que le prochain conteneur démarre à chaud
+    if embedding is not None and hasattr(embedding, "save"):
+        embedding.save()
 
 
 @app.get("/")
 async def root():
     return {"status": "SorakaBot API is running"}
 
+@app.get("/ready")
+async def ready():
+    if not services_ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready", "startup_timing": startup_timing}
+
+def service_stats() -> dict:
+    return {
+        "embedding_cache": embedding.stats() if hasattr(embedding, "stats") else None,
+        "response_cache": response_cache.stats(),
+        "sessions": session_store.stats(),
+        "llm_gateway": llm_gateway.stats(),
+        "history": history_builder.stats(),
+        "singleflight": inflight.stats() if inflight is not None else None,
+        "admission": admission.stats() if admission is not None else None,
+        "question_index": question_index.stats() if question_index is not None else None,
+        "translations": translation_store.stats() if translation_store is not None else None,
+        "vector_index": {
+            "documents": len(vector_index),
+            "age": time.time() - vector_index.loaded_at,
+            "stale": vector_index.is_stale()
+        } if vector_index is not None else None,
+        "streaming": {name: _latency_summary(values) for name, values in streaming_latency.items()},
+        "tiers": {tier: _latency_summary(values) for tier, values in tier_latency.items()}
+    }
+
+@app.get("/stats")
+async def stats():
+    return service_stats()
+
+# Compteurs des caches et des sessions, lus à chaque collecte de /metrics
+metrics.register_stats_collector(service_stats)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+@app.post("/admin/reindex")
+async def reindex():
+    """
+    Reconstruit les index en mémoire depuis la table, après une ingestion sans redémarrage.
+    """
+    await ensure_services_initialized()
+    tasks = [refresh_question_index()]
+    if USE_LEXICAL_INDEX:
+        tasks.append(refresh_lexical_index())
+    if USE_TRANSLATIONS:
+        tasks.append(refresh_translations())
+    if RETRIEVAL_ENGINE == "memory":
+        tasks.append(refresh_vector_index())
+    await asyncio.gather(*tasks)
+    return {
+        "question_index": len(question_index) if question_index is not None else None,
+        "lexical_index": len(lexical_index) if lexical_index is not None else None,
+        "translations": len(translation_store) if translation_store is not None else None,
+        "vector_index": len(vector_index) if vector_index is not None else None
+    }
+
+def _latency_summary(values) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": values[len(values) // 2],
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))]
+    }
+
+async def generate_answer(user_input: UserInput, context: dict) -> dict:
+    """
+    Génère la réponse de /answer à partir du contexte préparé par `prepare_answer`.
+    """
+    timer = context["timer"]
+    if context["type"] == "extractive_response":
+        doc, score = context["doc"], context["score"]
+        context["content"] = context["answer"]
+        await add_assistant_message(user_input.session_id, context["answer"])
+
+        with timed("serialization", timer):
+            response = {
+                "message": format_extractive_message(context["answer"], doc, score),
+                "metadata": combined_metadata(doc, score),
+                "session_id": user_input.session_id
+            }
+    elif context["type"] == "combined_response":
+        doc, score = context["doc"], context["score"]
+        cached_response = await response_cache.aget(context["cache_key"])
+        if cached_response is not None:
+            response_content = cached_response["content"]
+        else:
+            with timed("prompt_build", timer):
+                inputs = combined_inputs(user_input, doc, context["history_text"], context["answer"])
+            # D'abord obtenir une réponse ciblée de Gemini
+            with timed("llm", timer):
+                response_content = await coalesced(
+                    llm_coalesce_key("combined", user_input, context),
+                    lambda: llm_gateway.ainvoke("combined", user_input.temperature, inputs)
+                )
+            await response_cache.aset(context["cache_key"], {"content": response_content})
+
+        context["content"] = response_content
+        await add_assistant_message(user_input.session_id, response_content)
+
+        with timed("serialization", timer):
+            response = {
+                "message": format_combined_message(response_content, doc, score, context["answer"],
+                                                   context["lexical_score"]),
+                "metadata": combined_metadata(doc, score, context["lexical_score"]),
+                "session_id": user_input.session_id
+            }
+    else:  # Pas de bonne correspondance - laisser Gemini répondre librement
+        with timed("prompt_build", timer):
+            inputs = llm_inputs(user_input, context["history_text"])
+        with timed("llm", timer):
+            response_content = await coalesced(
+                llm_coalesce_key("llm", user_input, context),
+                lambda: llm_gateway.ainvoke("llm", user_input.temperature, inputs)
+            )
+
+        context["content"] = response_content
+        await add_assistant_message(user_input.session_id, response_content)
+
+        with timed("serialization", timer):
+            response = {
+                "message": response_content,
+                "session_id": user_input.session_id
+            }
+    response["response_type"] = context["type"]
+    if user_input.timings:
+        response.setdefault("metadata", {})["timings"] = timer.breakdown()
+    return response
+
+def record_tier(response_type: str, seconds: float):
+    # Niveau qui a servi la requête : latence et appels LLM évités par niveau
+    tier_latency[response_type].append(seconds)
+    if metrics.enabled:
+        metrics.TIER_SECONDS.labels(tier=response_type).observe(seconds)
+
+def error_response(e: Exception, endpoint: str = "answer") -> dict:
+    print(f"Erreur détaillée: {str(e)}")
+    if metrics.enabled:
+        metrics.ERRORS.labels(endpoint=endpoint).inc()
+    return {
+        "message": "Une erreur s'est produite lors du traitement de votre demande.",
+        "error": str(e)
+    }
+
+async def request_coalesce_key(user_input: UserInput):
+    # Premier tour d'une session : ses appels amont sont ceux de toute requête identique (voir `coalesce_key`)
+    if inflight is None or (user_input.session_id and await session_store.aget_history(user_input.session_id)):
+        return None
+    return (normalize_question(user_input.question), user_input.language.casefold(), user_input.temperature,
+            user_input.focus_area, user_input.source)
+
+@asynccontextmanager
+async def admission_slot():
+    """
+    Place du contrôle d'admission pendant le bloc (aucune si le contrôle est désactivé).
+    """
+    if admission is None:
+        yield
+    else:
+        async with admission.slot():
+            yield
+
+async def admitted_answer(user_input: UserInput, query_embedding: list[float] = None) -> tuple[dict, dict]:
+    """
+    Contexte et réponse de /answer, préparés et générés sous une place du contrôle d'admission.
+
+    Une requête de premier tour identique à une requête en cours attend le résultat de celle-ci
+    (attente de la place comprise) au lieu de prendre une place et de relancer les appels amont :
+    seule l'attente d'un calcul déjà en cours dispense de place. Sa session reçoit ensuite la
+    question et la réponse partagées, et la réponse porte son propre identifiant de session.
+    """
+    async def work() -> tuple[dict, dict]:
+        async with admission_slot():
+            context = await prepare_answer(user_input, query_embedding, timer=RequestTimer())
+            response = await generate_answer(user_input, context)
+        return context, response
+
+    key = await request_coalesce_key(user_input)
+    if key is None:
+        return await work()
+    key = ("request",) + key
+    joined = inflight.pending(key)
+    if joined and admission is not None:
+        admission.counters["joined"] += 1
+    context, response = await inflight.do(key, work)
+    if not joined:
+        return context, response
+
+    if not user_input.session_id:
+        user_input.session_id = str(uuid4())
+    await session_store.aappend(user_input.session_id, "user", user_input.question)
+    await add_assistant_message(user_input.session_id, context["content"])
+    if context["doc"] is not None and INFER_FOCUS_FILTER:
+        await session_store.aupdate_meta(user_input.session_id, focus_area=context["doc"].metadata.get("focus_area", ""))
+    return context, {**response, "session_id": user_input.session_id}
+
+async def degraded_response(user_input: UserInput, start_time: float) -> Optional[dict]:
+    context = await degraded_context(user_input)
+    if context is None:
+        return None
+    record_tier(context["type"], time.perf_counter() - start_time)
+    return {
+        "message": stream_message(context, context["content"]),
+        "metadata": combined_metadata(context["doc"], context["score"], context["lexical_score"]),
+        "session_id": user_input.session_id,
+        "response_type": context["type"],
+        "degraded": True
+    }
+
+async def serve_answer(user_input: UserInput, start_time: float, query_embedding: list[float] = None) -> dict:
+    """
+    Réponse d'une question de /answer ou de /answer/batch sous contrôle d'admission. En surcharge,
+    une réponse sans LLM est servie sans attendre de place. Lève OverloadedError si la question
+    est refusée et qu'aucune réponse de surcharge n'est disponible.
+    """
+    overloaded = admission is not None and admission.overloaded()
+    response = await degraded_response(user_input, start_time) if overloaded else None
+    if response is not None:
+        return response
+    try:
+        context, response = await admitted_answer(user_input, query_embedding)
+    except OverloadedError:
+        response = None if overloaded else await degraded_response(user_input, start_time)
+        if response is None:
+            raise
+        return response
+    record_tier(context["type"], time.perf_counter() - start_time)
+    return response
+
 @app.post("/answer")
 async def answer(user_input: UserInput):
+    start_time = time.perf_counter()
     try:
-        ensure_services_initialized()
-        # Gérer l'ID de session
-        if not user_input.session_id:
-            user_input.session_id = str(uuid4())
-        
-        # Initialiser l'historique si c'est une nouvelle session
-        if user_input.session_id not in conversation_history:
-            conversation_history[user_input.session_id] = []
-        
-        # Ajouter la question actuelle à l'historique
-        conversation_history[user_input.session_id].append({
-            "role": "user",
-            "content": user_input.question
-        })
-        
-        # Obtenir l'historique des 5 dernières interactions
-        recent_history = conversation_history[user_input.session_id][-10:]
-        
-        results = vector_store.similarity_search_with_score(user_input.question, k=1)
-        if results:
-            doc, score = results[0]
-            
-            if score < 0.2:  # Bonne correspondance
-                # D'abord obtenir une réponse ciblée de Gemini
-                llm = get_llm(user_input.temperature)
-                
-                # Inclure l'historique dans le prompt
-                history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent_history[:-1]])  # Exclure la question actuelle
-                
-                prompt = ChatPromptTemplate.from_messages([
-                    (
-                        "system",
-                        """Tu es SorakaBot, un assistant médical virtuel spécialisé.
-                        
-Voici l'historique de la conversation :
-{history}
-
-Voici une réponse de référence pour la question actuelle : {reference_answer}
-                        
-Utilise cette information et le contexte de la conversation pour répondre de manière précise à la question suivante en {language}.
-Sois concis et direct dans ta réponse.
-                        
-Question: {question}"""
-                    ),
-                    ("human", "{question}")
-                ])
-                
-                chain = prompt | llm
-                llm_response = chain.invoke({
-                    "language": user_input.language,
-                    "question": user_input.question,
-                    "reference_answer": doc.metadata['answer'],
-                    "history": history_text if history_text else "Pas d'historique précédent."
-                })
-                
-                # Ajouter la réponse à l'historique
-                conversation_history[user_input.session_id].append({
-                    "role": "assistant",
-                    "content": llm_response.content
-                })
-                
-                return {
-                    "message": f"""Réponse: {llm_response.content}
+        return await serve_answer(user_input, start_time)
+    except OverloadedError as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return error_response(e)
+    finally:
+        if metrics.enabled:
+            metrics.REQUEST_SECONDS.labels(endpoint="answer").observe(time.perf_counter() - start_time)
 
-Pour plus de détails :
-{doc.metadata['answer']}
+@app.post("/answer/batch")
+async def answer_batch(user_inputs: List[UserInput]):
+    """
+    Répond à une liste de questions : un seul appel d'embedding pour tout le lot,
+    des recherches concurrentes sur le pool de connexions et des appels LLM
+    limités par BATCH_LLM_CONCURRENCY. Les résultats gardent l'ordre des questions ;
+    une question en erreur n'interrompt pas le lot.
 
-Source : {doc.metadata['source']}
-Domaine médical : {doc.metadata['focus_area']}
-Score de similarité : {score:.4f}""",
-                    "metadata": {
-                        "source": doc.metadata['source'],
-                        "focus_area": doc.metadata['focus_area'],
-                        "similarity_score": f"{score:.4f}"
-                    },
-                    "session_id": user_input.session_id
+    Chaque question passe par le contrôle d'admission comme une requête /answer, au plus
+    BATCH_LLM_CONCURRENCY à la fois : un lot ne prend pas plus de places ni de file d'attente
+    qu'autant de requêtes. Une question refusée reçoit un résultat d'erreur avec `retry_after` ;
+    un lot entièrement refusé reçoit un 503.
+    """
+    if len(user_inputs) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Lot limité à {BATCH_MAX_SIZE} questions")
+    query_embeddings = [None] * len(user_inputs)
+    try:
+        await ensure_services_initialized()
+        # Les questions présentes dans l'index exact n'ont pas besoin d'embedding
+        to_embed = [i for i, user_input in enumerate(user_inputs)
+                    if question_index is None or user_input.question not in question_index]
+        if to_embed:
+            vectors = await embedding.aembed_documents([user_inputs[i].question for i in to_embed])
+            for i, vector in zip(to_embed, vectors):
+                query_embeddings[i] = vector
+    except Exception as e:
+        # Sans embedding groupé, chaque question est embeddée individuellement
+        print(f"Erreur d'embedding du lot: {str(e)}")
+
+    semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    rejected = []
+
+    async def answer_item(user_input: UserInput, query_embedding: list[float]) -> dict:
+        start_time = time.perf_counter()
+        try:
+            async with semaphore:
+                return await serve_answer(user_input, start_time, query_embedding)
+        except OverloadedError as e:
+            rejected.append(e)
+            return {"message": OVERLOADED_MESSAGE, "error": str(e), "retry_after": int(retry_after_header(e))}
+        except Exception as e:
+            return error_response(e, endpoint="batch")
+
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*(
+        answer_item(user_input, query_embedding) for user_input, query_embedding in zip(user_inputs, query_embeddings)
+    ))
+    if metrics.enabled:
+        metrics.REQUEST_SECONDS.labels(endpoint="batch").observe(time.perf_counter() - start_time)
+    if rejected and len(rejected) == len(results):
+        return overloaded_response(max(rejected, key=lambda e: e.retry_after), endpoint="batch")
+    if rejected and metrics.enabled:
+        metrics.ADMISSIONS.labels(outcome="rejected").inc(len(rejected))
+    return {"results": results}
+
+@app.post("/answer/stream")
+async def answer_stream(user_input: UserInput):
+    """
+    Variante de /answer en JSON lines : un événement "metadata" dès la fin de la recherche,
+    puis un événement "token" par fragment généré et un événement "done" avec le message complet.
+    """
+    start_time = time.perf_counter()
+    # Surcharge : réponse sans LLM servie sans attendre de place
+    overloaded = admission is not None and admission.overloaded()
+    context = await degraded_context(user_input) if overloaded else None
+    if context is not None:
+        return StreamingResponse(degraded_events(user_input, context, start_time), media_type="application/x-ndjson")
+
+    async def events():
+        # Place prise dans le générateur : elle est rendue par son finally, même si le flux
+        # est abandonné avant d'être lu
+        admitted_at = await admission.acquire() if admission is not None else None
+        timer = RequestTimer()
+        timed_out = False
+        try:
+            yield ""
+            context = await prepare_answer(user_input, timer=timer)
+            doc, score = context["doc"], context["score"]
+            yield _event({
+                "type": "metadata",
+                "response_type": context["type"],
+                "metadata": combined_metadata(doc, score, context["lexical_score"]) if doc is not None else {},
+                "session_id": user_input.session_id
+            })
+
+            cached_response = await response_cache.aget(context["cache_key"]) if context["cache_key"] else None
+            time_to_first_token = None
+            parts = []
+            if context["type"] == "extractive_response":
+                # Réponse de référence servie telle quelle, en un seul événement
+                time_to_first_token = time.perf_counter() - start_time
+                parts.append(context["answer"])
+                yield _event({"type": "token", "content": context["answer"]})
+            elif cached_response is not None:
+                time_to_first_token = time.perf_counter() - start_time
+                parts.append(cached_response["content"])
+                yield _event({"type": "token", "content": cached_response["content"]})
+            else:
+                with timed("prompt_build", timer):
+                    if doc is not None:
+                        kind, inputs = "combined", combined_inputs(user_input, doc, context["history_text"], context["answer"])
+                    else:
+                        kind, inputs = "llm", llm_inputs(user_input, context["history_text"])
+                with timed("llm", timer):
+                    async for token in llm_gateway.astream(kind, user_input.temperature, inputs):
+                        if time_to_first_token is None:
+                            time_to_first_token = time.perf_counter() - start_time
+                        parts.append(token)
+                        yield _event({"type": "token", "content": token})
+
+            response_content = "".join(parts)
+            if context["cache_key"] and cached_response is None:
+                await response_cache.aset(context["cache_key"], {"content": response_content})
+            await add_assistant_message(user_input.session_id, response_content)
+
+            total_time = time.perf_counter() - start_time
+            if time_to_first_token is not None:
+                streaming_latency["time_to_first_token"].append(time_to_first_token)
+            streaming_latency["total"].append(total_time)
+            record_tier(context["type"], total_time)
+            if metrics.enabled:
+                metrics.REQUEST_SECONDS.labels(endpoint="stream").observe(total_time)
+            with timed("serialization", timer):
+                done = {
+                    "type": "done",
+                    "message": stream_message(context, response_content),
+                    "time_to_first_token": time_to_first_token,
+                    "total_time": total_time
                 }
-            else:  # Pas de bonne correspondance - laisser Gemini répondre librement
-                llm = get_llm(user_input.temperature)
-                    
-                    # Inclure l'historique dans le prompt
-                history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent_history[:-1]])
-                    
-                prompt = ChatPromptTemplate.from_messages([
-                        (
-                            "system",
-                            """Tu es SorakaBot, un assistant médical virtuel spécialisé.
-
-                Voici l'historique de la conversation :
-                {history}
-                            
-                Réponds à la question de manière claire et précise en {language}.
-                Base ta réponse sur tes connaissances médicales générales et le contexte de la conversation.
-                N'oublie pas de recommander de consulter un professionnel de santé si nécessaire.
-
-                Question: {question}"""
-                        ),
-                        ("human", "{question}")
-                    ])
-                    
-                chain = prompt | llm
-                response = chain.invoke({
-                        "language": user_input.language,
-                        "question": user_input.question,
-                        "history": history_text if history_text else "Pas d'historique précédent."
-                    })
-                    
-                    # Ajouter la réponse à l'historique
-                conversation_history[user_input.session_id].append({
-                        "role": "assistant",
-                        "content": response.content
-                    })
-                    
-                return {
-                        "message": response.content,
-                        "session_id": user_input.session_id
-                    }
+            if user_input.timings:
+                done["timings"] = timer.breakdown()
+            yield _event(done)
+        except Exception as e:
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            print(f"Erreur détaillée: {str(e)}")
+            if metrics.enabled:
+                metrics.ERRORS.labels(endpoint="stream").inc()
+            yield _event({
+                "type": "error",
+                "message": "Une erreur s'est produite lors du traitement de votre demande.",
+                "error": str(e)
+            })
+        finally:
+            if admitted_at is not None:
+                admission.release(admitted_at, timed_out)
 
-    except Exception as e:
-        print(f"Erreur détaillée: {str(e)}")
-        return {
-            "message": "Une erreur s'est produite lors du traitement de votre demande.",
-            "error": str(e)
-        }
+    stream = events()
+    try:
+        # Place ou 503 avant tout envoi : le générateur s'arrête sur son premier yield une fois admis
+        await stream.__anext__()
+    except OverloadedError as e:
+        context = None if overloaded else await degraded_context(user_input)
+        if context is None:
+            return overloaded_response(e, endpoint="stream")
+        return StreamingResponse(degraded_events(user_input, context, start_time), media_type="application/x-ndjson")
+    return StreamingResponse(stream, media_type="application/x-ndjson")
+
+async def degraded_events(user_input: UserInput, context: dict, start_time: float):
+    # Réponse de surcharge en un seul fragment, au format de /answer/stream
+    yield _event({
+        "type": "metadata",
+        "response_type": context["type"],
+        "metadata": combined_metadata(context["doc"], context["score"], context["lexical_score"]),
+        "session_id": user_input.session_id,
+        "degraded": True
+    })
+    time_to_first_token = time.perf_counter() - start_time
+    yield _event({"type": "token", "content": context["content"]})
+    total_time = time.perf_counter() - start_time
+    record_tier(context["type"], total_time)
+    yield _event({
+        "type": "done",
+        "message": stream_message(context, context["content"]),
+        "time_to_first_token": time_to_first_token,
+        "total_time": total_time,
+        "degraded": True
+    })
+
+def stream_message(context: dict, response_content: str) -> str:
+    if context["type"] == "extractive_response":
+        return format_extractive_message(context["answer"], context["doc"], context["score"], context["lexical_score"])
+    if context["type"] == "combined_response":
+        return format_combined_message(response_content, context["doc"], context["score"], context["answer"],
+                                       context["lexical_score"])
+    return response_content
+
+def _event(payload: dict) -> str:
+    return json.dumps(payload, ensure_ascii=False) + "\n"
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,6 +1,7 @@
 # app.py
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 from streamlit_lottie import st_lottie
 import json
 
@@ -11,16 +12,42 @@ HOST = "https://mjb-api-217448161611.europe-west1.run.app"
 if "session_id" not in st.session_state:
     st.session_state.session_id = ""
 
-# Fonction pour charger l'animation Lottie
+# Session HTTP partagée par tous les reruns : connexions keep-alive réutilisées
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Animation Lottie téléchargée une seule fois ; un échec lève une exception et n'est donc pas mis en cache
+@st.cache_data(ttl=24 * 3600)
+def fetch_lottie(url: str):
+    r = get_http_session().get(url, timeout=10)
+    r.raise_for_status()
+    return r.json()
+
 def load_lottie_url(url: str):
     try:
-        r = requests.get(url)
-        if r.status_code != 200:
-            return None
-        return r.json()
+        return fetch_lottie(url)
     except:
         return None
 
+def turn_payload(question: str, temperature: float, language: str, session_id: str) -> dict:
+    # Seul le nouveau tour est envoyé : l'API garde l'historique de la session
+    return {
+        "question": question,
+        "temperature": temperature,
+        "language": language,
+        "session_id": session_id
+    }
+
+def _prepend(first, rest):
+    if first:
+        yield first
+    yield from rest
+
 # Configuration de la page
 st.set_page_config(
     page_title="SorakaBot - Assistant Médical",
@@ -188,28 +215,48 @@ elif st.session_state.page == 'chat':
         st.chat_message("user", avatar="👤").write(question)
         
         try:
-            with st.spinner("🏥 Analyse de votre question..."):
-                response = requests.post(
-                    f"{HOST}/answer",
-                    json={
-                        "question": question,
-                        "temperature": temperature,
-                        "language": language,
-                        "session_id": st.session_state.session_id,
-                        "previous_context": st.session_state["messages"]
-                    },
-                    timeout=30
-                )
-                
-                if response.status_code == 200:
-                    response_data = response.json()
-                    answer = response.json().get("message", "Désolé, je n'ai pas pu traiter votre demande.")
-                    if "session_id" in response_data:
-                        st.session_state.session_id = response_data["session_id"]
-                    st.session_state["messages"].append({"role": "assistant", "content": answer})
-                    st.chat_message("assistant", avatar="🏥").write(answer)
-                else:
-                    st.error(f"Erreur: {response.status_code} - {response.text}")
+            response = get_http_session().post(
+                f"{HOST}/answer/stream",
+                json=turn_payload(question, temperature, language, st.session_state.session_id),
+                timeout=30,
+                stream=True
+            )
+            
+            if response.status_code == 200:
+                events = (json.loads(line) for line in response.iter_lines(decode_unicode=True) if line)
+                final_event = {}
+
+                # Les fragments de la réponse s'affichent au fur et à mesure de leur génération
+                def stream_tokens():
+                    for event in events:
+                        if event["type"] == "metadata" and event.get("session_id"):
+                            st.session_state.session_id = event["session_id"]
+                        elif event["type"] == "token":
+                            yield event["content"]
+                        elif event["type"] in ("done", "error"):
+                            final_event.update(event)
+
+                with st.chat_message("assistant", avatar="🏥"):
+                    tokens = stream_tokens()
+                    # Le spinner reste affiché jusqu'au premier fragment
+                    with st.spinner("🏥 Analyse de votre question..."):
+                        first_token = next(tokens, "")
+                    streamed = st.write_stream(_prepend(first_token, tokens))
+                    # Les détails (référence, source, score) complètent la réponse une fois le flux terminé
+                    answer = final_event.get("message", "Désolé, je n'ai pas pu traiter votre demande.")
+                    details = answer.split("Pour plus de détails :", 1)
+                    if len(details) == 2:
+                        st.markdown("Pour plus de détails :" + details[1])
+                    elif isinstance(streamed, str) and answer.startswith(streamed) and answer != streamed:
+                        # Réponse extractive : la source et le domaine médical suivent la réponse de référence
+                        st.markdown(answer[len(streamed):])
+                st.session_state["messages"].append({"role": "assistant", "content": answer})
+            elif response.status_code == 503:
+                # API surchargée : la question est refusée tout de suite plutôt qu'après le délai
+                st.warning(f"Le service est très sollicité, veuillez réessayer dans "
+                           f"{response.headers.get('Retry-After', 'quelques')} secondes.")
+            else:
+                st.error(f"Erreur: {response.status_code} - {response.text}")
         
         except requests.exceptions.RequestException as e:
-            st.error(f"Erreur de communication avec le serveur: {str(e)}")
\ No newline at end of file
+            st.error(f"Erreur de communication avec le serveur: {str(e)}")
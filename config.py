@@ -1,6 +1,130 @@
+import os
+
 PROJECT_ID = "projet-gcp-450616"
 INSTANCE = "soraka-instance"
 REGION = "europe-west1"
 DATABASE = "health_db"
 DB_USER = "postgres"
-TABLE_NAME = "medical_qa"
\ No newline at end of file
+TABLE_NAME = "medical_qa"
+
+# Service d'embedding (embedding_backends.py) : "vertex", "local" (modèle CPU dans le processus) ou "hashing" (hors ligne)
+# Les vecteurs de deux backends ne sont pas comparables : changer de backend impose de réingérer la table
+# et de vider le cache persistant des embeddings
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "vertex")
+EMBEDDING_MODEL = "textembedding-gecko@latest"
+EMBEDDING_LOCAL_MODEL = os.getenv("EMBEDDING_LOCAL_MODEL", "sentence-transformers/paraphrase-multilingual-mpnet-base-v2")  # 768 dimensions comme gecko
+EMBEDDING_SIZE = 768  # dimension du backend "hashing"
+EMBEDDING_BATCH_SIZE = 32  # questions concurrentes regroupées en un passage du modèle local
+EMBEDDING_BATCH_WAIT = 0.005  # secondes d'attente maximale pour compléter un micro-lot
+EMBEDDING_WORKERS = 2  # threads de calcul du modèle local
+
+# Cache des embeddings de questions
+EMBEDDING_CACHE_SIZE = 10000
+EMBEDDING_CACHE_TTL = None  # secondes, None = pas d'expiration
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")  # fichier .npz pour démarrer à chaud
+
+# Cache des réponses de la branche combined_response
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # "memory" ou "sqlite"
+RESPONSE_CACHE_SIZE = 5000
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+
+# Moteur de recherche vectorielle : "pgvector" (Cloud SQL) ou "memory" (index en mémoire)
+RETRIEVAL_ENGINE = os.getenv("RETRIEVAL_ENGINE", "pgvector")
+VECTOR_INDEX_MAX_AGE = 3600  # secondes avant rechargement de l'index en mémoire
+
+# Stockage des sessions : "memory" (un worker) ou "sqlite" (fichier WAL partagé entre workers)
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.sqlite3")
+SESSION_MAX_MESSAGES = 20
+SESSION_MAX_SESSIONS = 10000
+SESSION_IDLE_TTL = 3600  # secondes
+
+# Endpoint /answer/batch
+BATCH_MAX_SIZE = 500
+BATCH_LLM_CONCURRENCY = 8  # appels LLM simultanés par lot
+
+# Ingestion de medquad.csv
+CSV_PATH = "./downloaded_files/medquad.csv"
+INGEST_CHECKPOINT_PATH = "ingest_checkpoint.json"
+INGEST_CHUNK_SIZE = 1000  # lignes lues par bloc
+INGEST_EMBED_BATCH_SIZE = 100  # textes par appel d'embedding
+INGEST_CONCURRENCY = 4  # lots embeddés et insérés en parallèle
+INGEST_REQUESTS_PER_MINUTE = 300  # quota d'appels d'embedding
+
+# Préchauffage au démarrage
+WARMUP_DB_CONNECTIONS = 5  # connexions du pool ouvertes avant le premier utilisateur
+WARMUP_QUESTION = "What is (are) Glaucoma ?"
+
+# Passerelle LLM
+LLM_MODEL = "gemini-1.5-pro"
+LLM_TIMEOUT = 20.0  # délai maximal d'une génération, nouvelles tentatives comprises (secondes)
+LLM_MAX_RETRIES = 2
+LLM_BACKOFF_BASE = 0.5  # secondes, doublé à chaque tentative, avec gigue
+LLM_BACKOFF_MAX = 4.0
+LLM_MAX_CONCURRENCY = 16  # appels simultanés par worker
+LLM_BREAKER_FAILURES = 5  # échecs consécutifs avant ouverture du disjoncteur
+LLM_BREAKER_RESET = 30.0  # secondes avant un appel d'essai
+
+# Index exact des questions (court-circuite embedding et recherche vectorielle)
+USE_QUESTION_INDEX = os.getenv("USE_QUESTION_INDEX", "true") == "true"
+QUESTION_INDEX_PATH = os.getenv("QUESTION_INDEX_PATH", "question_index.jsonl")  # écrit à l'ingestion
+
+# Colonnes indexées de medical_qa, utilisables comme filtre de la recherche vectorielle
+METADATA_COLUMNS = ["focus_area", "source"]
+SIMILARITY_THRESHOLD = 0.2  # distance cosinus en dessous de laquelle une réponse de référence est utilisée
+INFER_FOCUS_FILTER = os.getenv("INFER_FOCUS_FILTER", "true") == "true"  # filtre déduit du dernier domaine trouvé
+
+# Index pgvector de medical_qa (voir pgvector_index.py) : "hnsw" ou "ivfflat"
+PGVECTOR_INDEX_TYPE = os.getenv("PGVECTOR_INDEX_TYPE", "hnsw")
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))  # appliqué à chaque requête
+IVFFLAT_LISTS = None  # None = lignes / 1000 (minimum 1), recommandation pgvector
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))  # appliqué à chaque requête
+
+# Métriques Prometheus (/metrics) et durées par étape
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true") == "true"
+
+# Historique des prompts : budget en tokens, les tours plus anciens sont résumés en arrière-plan
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "800"))  # 0 = 9 derniers messages en entier
+HISTORY_SUMMARY_MAX_WORDS = 120
+
+# Routage par niveaux : une correspondance quasi exacte est servie telle quelle, sans LLM
+EXTRACTIVE_MATCH_SCORE = float(os.getenv("EXTRACTIVE_MATCH_SCORE", "0.05"))  # 0 = désactivé
+CORPUS_LANGUAGE = "en"  # langue des réponses de medquad.csv
+
+# Réponses de référence pré-traduites (translations.py), servies selon l'id du document et la langue
+USE_TRANSLATIONS = os.getenv("USE_TRANSLATIONS", "true") == "true"
+TRANSLATIONS_TABLE = "medical_qa_translations"
+TRANSLATION_LANGUAGES = ["fr", "ar"]  # langues de app.py hors anglais
+TRANSLATION_CONCURRENCY = 8  # appels de traduction simultanés du job hors ligne
+# Libellés acceptés pour `language` -> code de langue
+LANGUAGE_CODES = {
+    "en": "en", "english": "en", "anglais": "en",
+    "fr": "fr", "francais": "fr", "français": "fr", "french": "fr",
+    "ar": "ar", "arabic": "ar", "arabe": "ar", "العربية": "ar",
+}
+
+# Recherche lexicale BM25 (lexical_index.py) sur les questions et réponses, fusionnée avec la recherche vectorielle
+USE_LEXICAL_INDEX = os.getenv("USE_LEXICAL_INDEX", "true") == "true"
+LEXICAL_MATCH_SCORE = float(os.getenv("LEXICAL_MATCH_SCORE", "0.9"))  # confiance BM25 (0-1) qui court-circuite l'embedding ; 0 = jamais
+LEXICAL_MARGIN = 0.1  # avance relative minimale du premier document lexical sur le second
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_QUESTION_WEIGHT = 3  # un mot de la question compte comme 3 mots de la réponse
+HYBRID_CANDIDATES = 10  # documents de chaque recherche passés à la fusion
+RRF_K = 60  # constante de la fusion par rang réciproque
+
+# Regroupement des requêtes concurrentes identiques sans historique (singleflight.py)
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true") == "true"
+
+# Contrôle d'admission de /answer et /answer/stream (admission.py) : places bornées, file bornée, limite adaptée à la latence
+USE_ADMISSION_CONTROL = os.getenv("USE_ADMISSION_CONTROL", "true") == "true"
+ADMISSION_INITIAL_LIMIT = 32  # requêtes traitées simultanément par worker au démarrage
+ADMISSION_MIN_LIMIT = 4
+ADMISSION_MAX_LIMIT = 128
+ADMISSION_MAX_QUEUE = 64  # requêtes en attente d'une place, au-delà : 503 immédiat
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5.0"))  # attente maximale d'une place (secondes)
+ADMISSION_LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET", "10.0"))  # temps de service au-delà duquel la limite baisse
+ADMISSION_BACKOFF = 0.9
+ADMISSION_OVERLOAD_WINDOW = 10.0  # secondes de mode dégradé (réponses en cache ou extractives d'abord) après un refus
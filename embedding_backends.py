@@ -0,0 +1,184 @@
+"""
+Services d'embedding interchangeables, choisis par EMBEDDING_BACKEND :
+
+- "vertex" : Vertex AI (textembedding-gecko), un aller-retour réseau par appel ;
+- "local" : modèle sentence-transformers exécuté sur le CPU du processus ; les
+  requêtes concurrentes sont regroupées en micro-lots calculés dans un pool de
+  threads, sans bloquer la boucle d'événements ;
+- "hashing" : hachage déterministe des mots, sans modèle ni réseau (tests hors ligne).
+
+Tous exposent l'interface `Embeddings` de LangChain, utilisée telle quelle par
+l'API, l'ingestion et l'évaluation. Les vecteurs de deux backends ne sont pas
+comparables : changer de backend impose de réingérer la table.
+"""
+import asyncio
+import hashlib
+import importlib.util
+import math
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from config import (
+    EMBEDDING_MODEL, EMBEDDING_LOCAL_MODEL, EMBEDDING_SIZE, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT, EMBEDDING_WORKERS
+)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embedding déterministe par hachage signé des mots, normalisé.
+    """
+
+    def __init__(self, size: int = EMBEDDING_SIZE):
+        self.size = size
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.size
+            vector[index] += 1.0 if digest[4] % 2 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+
+class MicroBatcher:
+    """
+    Regroupe les textes soumis en même temps en un seul appel de `encode`, exécuté
+    dans `executor`. Un lot part dès qu'il atteint `max_batch_size` textes, ou
+    `max_wait` secondes après l'arrivée de son premier texte.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], List[List[float]]], executor: ThreadPoolExecutor,
+                 max_batch_size: int = 32, max_wait: float = 0.005):
+        self.encode = encode
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []  # (texte, future)
+        self._timer = None
+        self._running = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.encode, [text for text, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Modèle sentence-transformers sur CPU, chargé au premier appel.
+
+    Args:
+        model_name (str): Modèle sentence-transformers.
+        max_batch_size (int): Taille maximale d'un micro-lot (et des lots de embed_documents).
+        max_wait (float): Attente maximale, en secondes, pour compléter un micro-lot.
+        workers (int): Threads du pool de calcul.
+        encode (Callable, optional): Fonction textes -> vecteurs à la place du modèle.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_LOCAL_MODEL, max_batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_wait: float = EMBEDDING_BATCH_WAIT, workers: int = EMBEDDING_WORKERS,
+                 encode: Optional[Callable[[List[str]], List[List[float]]]] = None):
+        if encode is None and importlib.util.find_spec("sentence_transformers") is None:
+            # Échec au démarrage plutôt qu'à la première requête ; le module lui-même n'est importé qu'au premier appel
+            raise ImportError(
+                'Le backend d\'embedding "local" nécessite sentence-transformers (dépendance optionnelle) : '
+                "pip install sentence-transformers"
+            )
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._encode = encode or self._model_encode
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding")
+        self.batcher = MicroBatcher(self._encode, self._executor, max_batch_size=max_batch_size, max_wait=max_wait)
+
+    def _model_encode(self, texts: List[str]) -> List[List[float]]:
+        with self._model_lock:
+            if self._model is None:
+                # Import différé : sentence-transformers (et torch) n'est requis que pour ce backend
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name, device="cpu")
+        return self._model.encode(texts, batch_size=self.max_batch_size, normalize_embeddings=True).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.max_batch_size):
+            vectors.extend(self._encode(texts[i:i + self.max_batch_size]))
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.batcher.submit(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.embed_documents, texts)
+
+    def stats(self) -> dict:
+        return self.batcher.stats()
+
+
+def create_embeddings(backend: str = "vertex", project: Optional[str] = None) -> Embeddings:
+    """
+    Construit le service d'embedding du backend choisi ("vertex", "local" ou "hashing").
+    """
+    if backend == "vertex":
+        from langchain_google_vertexai import VertexAIEmbeddings
+        return VertexAIEmbeddings(model_name=EMBEDDING_MODEL, project=project)
+    if backend == "local":
+        return LocalEmbeddings()
+    if backend == "hashing":
+        return HashingEmbeddings()
+    raise ValueError(f"Backend d'embedding inconnu : {backend}")
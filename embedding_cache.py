@@ -0,0 +1,145 @@
+"""
+Cache LRU/TTL des embeddings de questions devant le service d'embedding.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from text_utils import normalize_question
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Enveloppe un service d'embedding et mémorise les vecteurs par question normalisée.
+
+    Args:
+        embedding (Embeddings): Le service d'embedding (voir embedding_backends.py).
+        max_size (int): Nombre maximal de questions gardées, éviction LRU au-delà.
+        ttl (float, optional): Durée de vie d'une entrée en secondes.
+        path (str, optional): Fichier .npz chargé au démarrage et écrit par `save`.
+    """
+
+    def __init__(self, embedding: Embeddings, max_size: int = 10000, ttl: Optional[float] = None, path: Optional[str] = None):
+        self.embedding = embedding
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # clé -> (vecteur, date de création)
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            vector, created_at = entry
+            if self.ttl is not None and time.time() - created_at > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(vector)
+
+    def _put(self, key: str, vector: List[float], created_at: Optional[float] = None):
+        with self._lock:
+            self._entries[key] = (list(vector), created_at or time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_question(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self.embedding.embed_query(text)
+            self._put(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = normalize_question(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = await self.embedding.aembed_query(text)
+            self._put(key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = self._lookup_many(texts)
+        if missing:
+            computed = self.embedding.embed_documents([texts[i] for i in missing])
+            self._fill(texts, vectors, missing, computed)
+        return vectors
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = self._lookup_many(texts)
+        if missing:
+            computed = await self.embedding.aembed_documents([texts[i] for i in missing])
+            self._fill(texts, vectors, missing, computed)
+        return vectors
+
+    def _lookup_many(self, texts: List[str]) -> tuple:
+        vectors = [self._get(normalize_question(text)) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        return vectors, missing
+
+    def _fill(self, texts: List[str], vectors: list, missing: List[int], computed: List[List[float]]):
+        # Un seul appel distant pour toutes les questions absentes du cache
+        for i, vector in zip(missing, computed):
+            vectors[i] = vector
+            self._put(normalize_question(texts[i]), vector)
+
+    def stats(self) -> dict:
+        """
+        Compteurs du cache : chaque hit est un appel d'embedding distant évité.
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "backend": self.embedding.stats() if hasattr(self.embedding, "stats") else None,
+        }
+
+    def save(self, path: Optional[str] = None):
+        """
+        Écrit le contenu du cache dans un fichier .npz (écriture atomique).
+        """
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            items = list(self._entries.items())
+        keys = np.array([key for key, _ in items], dtype=str)
+        vectors = np.array([vector for _, (vector, _) in items], dtype=np.float32)
+        created = np.array([created_at for _, (_, created_at) in items], dtype=np.float64)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=keys, vectors=vectors, created=created)
+        os.replace(tmp_path, path)
+
+    def load(self, path: Optional[str] = None):
+        """
+        Recharge un cache écrit par `save`, en ignorant les entrées expirées.
+        """
+        path = path or self.path
+        try:
+            data = np.load(path, allow_pickle=False)
+            now = time.time()
+            for key, vector, created_at in zip(data["keys"], data["vectors"], data["created"]):
+                if self.ttl is None or now - created_at <= self.ttl:
+                    self._put(str(key), vector.tolist(), float(created_at))
+        except Exception as e:
+            print(f"Cache d'embeddings illisible ({path}): {str(e)}")
@@ -1,53 +1,79 @@
 import pandas as pd
 import numpy as np
 import requests
-from utils_eval import calculate_relevance, was_answer_found_in_db, display_evaluation_results
+from utils_eval import (
+    calculate_relevance_batch, was_answer_found_in_db, display_evaluation_results,
+    CorpusScorer, retrieval_metrics
+)
+from config import CSV_PATH, TABLE_NAME, SIMILARITY_THRESHOLD, EMBEDDING_BACKEND
+import argparse
+import json
+import os
 import time
 
-def load_random_samples(n=10):
-    """Charge n exemples aléatoires du dataset"""
-    df = pd.read_csv("./downloaded_files/medquad.csv")
+def load_corpus(path: str = CSV_PATH) -> pd.DataFrame:
+    """Charge tout le dataset, questions nettoyées"""
+    df = pd.read_csv(path)
     # Nettoyer les questions (supprimer les "? ?" ou espaces multiples)
     df['question'] = df['question'].str.replace(r'\s*\?\s*\?', '?', regex=True).str.strip()
-    return df.sample(n=n, random_state=42)
+    df['answer'] = df['answer'].fillna("Pas de réponse disponible")
+    return df
 
-def get_chatbot_response(question: str) -> dict:
+def load_random_samples(n=10):
+    """Charge n exemples aléatoires du dataset"""
+    return load_corpus().sample(n=n, random_state=42)
+
+API_URL = "https://mjb-api-217448161611.europe-west1.run.app/answer"
+
+def build_payload(question: str, session_id: str = "") -> dict:
     """
-    Appelle l'API déployée sur Cloud Run pour obtenir une réponse.
+    Corps de la requête /answer utilisé par l'évaluation et le test de charge.
     """
-    url = "https://mjb-api-217448161611.europe-west1.run.app/answer"
-    payload = {
+    return {
         "question": question,
         "temperature": 0.5,
         "language": "en",
-        "session_id": ""  # Champ optionnel, laissé vide
+        "session_id": session_id  # Champ optionnel, laissé vide
     }
+
+def parse_chatbot_response(json_data: dict, response_time: float) -> dict:
+    """
+    Extrait réponse, réponse de référence, source, domaine, score et type d'une réponse de /answer.
+    """
+    message = json_data.get("message", "")
+
+    # Parser le message pour extraire les champs
+    response_text = message.split("Pour plus de détails :")[0].replace("Réponse: ", "").strip() if "Pour plus de détails :" in message else message
+    db_answer = message.split("Pour plus de détails :\n")[1].split("\nSource :")[0].strip() if "Pour plus de détails :" in message else ""
+    source = json_data.get("metadata", {}).get("source", "") or (message.split("Source : ")[1].split("\n")[0].strip() if "Source :" in message else "")
+    focus_area = json_data.get("metadata", {}).get("focus_area", "") or (message.split("Domaine médical : ")[1].split("\n")[0].strip() if "Domaine médical :" in message else "")
+    score = float(json_data.get("metadata", {}).get("similarity_score", "0.0")) or float(message.split("Score de similarité : ")[1].strip() if "Score de similarité :" in message else "0.0")
+    response_type = json_data.get("response_type") or ("combined_response" if "Pour plus de détails :" in message else "llm_response")
+    if response_type == "extractive_response":
+        # Réponse de référence servie sans LLM : réponse et référence sont identiques
+        response_text = db_answer = message.split("\n\nSource :")[0].strip()
+
+    return {
+        "response": response_text,
+        "db_answer": db_answer,
+        "source": source,
+        "focus_area": focus_area,
+        "score": score,
+        "type": response_type,
+        "response_time": response_time
+    }
+
+def get_chatbot_response(question: str) -> dict:
+    """
+    Appelle l'API déployée sur Cloud Run pour obtenir une réponse.
+    """
     try:
         start_time = time.time()
-        response = requests.post(url, json=payload, timeout=60)  # Timeout à 60s pour cold starts
+        response = requests.post(API_URL, json=build_payload(question), timeout=60)  # Timeout à 60s pour cold starts
         response_time = time.time() - start_time
         
         if response.ok:
-            json_data = response.json()
-            message = json_data.get("message", "")
-            
-            # Parser le message pour extraire les champs
-            response_text = message.split("Pour plus de détails :")[0].replace("Réponse: ", "").strip() if "Pour plus de détails :" in message else message
-            db_answer = message.split("Pour plus de détails :\n")[1].split("\nSource :")[0].strip() if "Pour plus de détails :" in message else ""
-            source = json_data.get("metadata", {}).get("source", "") or (message.split("Source : ")[1].split("\n")[0].strip() if "Source :" in message else "")
-            focus_area = json_data.get("metadata", {}).get("focus_area", "") or (message.split("Domaine médical : ")[1].split("\n")[0].strip() if "Domaine médical :" in message else "")
-            score = float(json_data.get("metadata", {}).get("similarity_score", "0.0")) or float(message.split("Score de similarité : ")[1].strip() if "Score de similarité :" in message else "0.0")
-            response_type = "combined_response" if "Pour plus de détails :" in message else "llm_response"
-            
-            return {
-                "response": response_text,
-                "db_answer": db_answer,
-                "source": source,
-                "focus_area": focus_area,
-                "score": score,
-                "type": response_type,
-                "response_time": response_time
-            }
+            return parse_chatbot_response(response.json(), response_time)
         else:
             print(f"Erreur HTTP {response.status_code}: {response.text}")
             return None
@@ -56,23 +82,239 @@ def get_chatbot_response(question: str) -> dict:
         return None
 
 def evaluate_response(question, true_answer, chatbot_response):
-    """Évalue une réponse du chatbot"""
+    """Évalue une réponse du chatbot (la pertinence est calculée par lot, voir `calculate_relevance_batch`)"""
     if chatbot_response is None:
         return {
-            "relevance_score": 0.0,
             "retrieval_success": False,
             "response_time": 0.0
         }
     
     metrics = {
-        "relevance_score": calculate_relevance(chatbot_response, true_answer),
         "retrieval_success": was_answer_found_in_db(chatbot_response),
         "response_time": chatbot_response["response_time"]
     }
     return metrics
 
-def main():
-    samples = load_random_samples(10)
+def load_search_index(export_prefix: str):
+    """
+    Index exact en mémoire des documents de medical_qa : depuis un export (`ingest.py export`) s'il existe,
+    sinon depuis la table.
+    """
+    import asyncio
+    from langchain_core.documents.base import Document
+    from ingest import create_cloud_sql_database_connection_async, export_paths
+    from vector_index import InMemoryVectorIndex
+
+    vectors_path, documents_path = export_paths(export_prefix)
+    if os.path.exists(vectors_path) and os.path.exists(documents_path):
+        with open(documents_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        documents = [Document(id=r["id"], page_content=r["content"], metadata=r["metadata"]) for r in records]
+        return InMemoryVectorIndex(documents, np.load(vectors_path))
+
+    async def load():
+        engine = await create_cloud_sql_database_connection_async()
+        return await InMemoryVectorIndex.aload(engine, TABLE_NAME)
+    return asyncio.run(load())
+
+def embed_questions(questions: list, cache_path: str = None, batch_size: int = 250) -> np.ndarray:
+    """
+    Embeddings des questions par lots ; gardés dans cache_path (.npy) pour les exécutions suivantes.
+    """
+    if cache_path and os.path.exists(cache_path):
+        vectors = np.load(cache_path)
+        if len(vectors) == len(questions):
+            return vectors
+    from ingest import get_embeddings
+
+    embedding = get_embeddings()
+    vectors = []
+    for i in range(0, len(questions), batch_size):
+        vectors.extend(embedding.embed_documents(questions[i:i + batch_size]))
+        print(f"{min(i + batch_size, len(questions))}/{len(questions)} questions embeddées")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if cache_path:
+        np.save(cache_path, vectors)
+    return vectors
+
+def search_top_k(index, query_vectors: np.ndarray, k: int = 4, chunk_size: int = 1024) -> tuple:
+    """
+    Les k documents les plus proches de chaque requête, par blocs de produits matriciels.
+
+    Returns:
+        tuple: positions des documents dans l'index (n, k) et distances cosinus (n, k).
+    """
+    norms = np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    queries = (query_vectors / norms).astype(np.float32)
+    positions, distances = [], []
+    for i in range(0, len(queries), chunk_size):
+        block = 1.0 - queries[i:i + chunk_size] @ index._matrix.T
+        top = np.argpartition(block, k - 1, axis=1)[:, :k]
+        top_distances = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        positions.append(np.take_along_axis(top, order, axis=1))
+        distances.append(np.take_along_axis(top_distances, order, axis=1))
+    return np.vstack(positions), np.vstack(distances)
+
+def evaluate_corpus(corpus: pd.DataFrame, index, query_vectors: np.ndarray, scorer: CorpusScorer, k: int = 4) -> tuple:
+    """
+    Recall@1/@4 et MRR de la recherche sur toutes les questions du corpus, et pertinence de la réponse
+    de référence retrouvée en premier par rapport à la vraie réponse.
+
+    Un document est correct s'il porte la même question (repliée) que la requête : le corpus contient
+    des questions en double dont les documents sont indiscernables.
+    """
+    from text_utils import fold_question
+
+    relevant = {}
+    for position, doc in enumerate(index.documents):
+        relevant.setdefault(fold_question(doc.page_content), set()).add(position)
+
+    positions, distances = search_top_k(index, query_vectors, k=k)
+    ranks = []
+    for question, top in zip(corpus['question'], positions):
+        expected = relevant.get(fold_question(question), set())
+        ranks.append(next((j + 1 for j, position in enumerate(top) if position in expected), None))
+
+    retrieved_answers = [index.documents[top[0]].metadata.get("answer", "") for top in positions]
+    relevance = scorer.score_pairs(retrieved_answers, corpus['answer'].tolist())
+
+    details = pd.DataFrame({
+        "row_index": corpus.index,
+        "rank": [rank or 0 for rank in ranks],
+        "top1_row_index": [index.documents[top[0]].metadata.get("row_index", -1) for top in positions],
+        "top1_distance": distances[:, 0],
+        "answer_relevance": relevance,
+    })
+    summary = {
+        "questions": len(corpus),
+        **retrieval_metrics(ranks),
+        "answer_relevance": float(np.mean(relevance)),
+        "below_threshold": float(np.mean(distances[:, 0] < SIMILARITY_THRESHOLD)),
+    }
+    return summary, details
+
+def evaluate_hybrid(name: str, queries: list, is_expected, index, query_vectors: np.ndarray, lexical_index) -> tuple:
+    """
+    Taux de bonnes correspondances (distance sous SIMILARITY_THRESHOLD, ou BM25 sûr de lui) de la recherche
+    vectorielle seule et de la recherche hybride, part de celles qui trouvent le bon document
+    (`is_expected(requête, document)`), et latence ajoutée par la partie lexicale.
+    """
+    from config import HYBRID_CANDIDATES
+    from retrieve import lexical_match, _fuse_lexical
+
+    positions, distances = search_top_k(index, query_vectors, k=HYBRID_CANDIDATES)
+    rows = []
+    for query, vector, top, top_distances in zip(queries, query_vectors, positions, distances):
+        vector_results = [(index.documents[position], float(distance)) for position, distance in zip(top, top_distances)]
+        vector_doc, vector_distance = vector_results[0]
+
+        start = time.perf_counter()
+        lexical_hit = lexical_match(query, lexical_index)
+        if lexical_hit is not None:
+            hybrid_doc, hybrid_hit, method = lexical_hit[0], True, "lexical"
+        else:
+            fused = _fuse_lexical(query, vector, vector_results, index, lexical_index, None)
+            hybrid_doc, hybrid_hit, method = fused[0][0], fused[0][1] < SIMILARITY_THRESHOLD, "hybrid"
+        lexical_seconds = time.perf_counter() - start
+
+        vector_hit = vector_distance < SIMILARITY_THRESHOLD
+        rows.append({
+            "set": name,
+            "query": query,
+            "vector_hit": vector_hit,
+            "vector_correct_hit": vector_hit and is_expected(query, vector_doc),
+            "hybrid_hit": hybrid_hit,
+            "hybrid_correct_hit": hybrid_hit and is_expected(query, hybrid_doc),
+            "method": method,
+            "lexical_ms": lexical_seconds * 1000,
+        })
+    details = pd.DataFrame(rows)
+    summary = {
+        f"{name}_queries": len(details),
+        f"{name}_vector_hit_rate": float(details["vector_hit"].mean()),
+        f"{name}_hybrid_hit_rate": float(details["hybrid_hit"].mean()),
+        f"{name}_vector_correct_hit_rate": float(details["vector_correct_hit"].mean()),
+        f"{name}_hybrid_correct_hit_rate": float(details["hybrid_correct_hit"].mean()),
+        f"{name}_lexical_shortcut_rate": float((details["method"] == "lexical").mean()),
+        f"{name}_lexical_ms_p50": float(details["lexical_ms"].quantile(0.5)),
+        f"{name}_lexical_ms_p95": float(details["lexical_ms"].quantile(0.95)),
+    }
+    return summary, details
+
+def write_results(prefix: str, summary: dict, details: pd.DataFrame):
+    # Valeurs arrondies et clés triées : deux exécutions se comparent avec un simple diff
+    with open(f"{prefix}.json", "w", encoding="utf-8") as f:
+        json.dump({key: round(value, 4) if isinstance(value, float) else value for key, value in summary.items()},
+                  f, indent=2, sort_keys=True)
+        f.write("\n")
+    details.to_csv(f"{prefix}.csv", index=False, float_format="%.4f")
+
+def corpus_main(args):
+    timings = {}
+    start = time.perf_counter()
+    corpus = load_corpus(args.csv)
+    if args.limit:
+        corpus = corpus.iloc[:args.limit]
+    scorer = CorpusScorer(load_corpus(args.csv)['answer'])
+    timings["corpus"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = load_search_index(args.export)
+    timings["index"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    query_vectors = embed_questions(corpus['question'].tolist(), args.query_embeddings, args.batch_size)
+    timings["embeddings"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summary, details = evaluate_corpus(corpus, index, query_vectors, scorer)
+    timings["evaluation"] = time.perf_counter() - start
+
+    write_results(args.out, summary, details)
+    for metric, value in summary.items():
+        print(f"{metric}: {value:.4f}" if isinstance(value, float) else f"{metric}: {value}")
+    print("Durées : " + ", ".join(f"{stage}={seconds:.1f}s" for stage, seconds in timings.items()))
+    print(f"Résultats écrits dans {args.out}.json et {args.out}.csv")
+
+def lexical_main(args):
+    """
+    Recherche vectorielle seule contre hybride (BM25 + RRF) sur les questions du corpus
+    et sur des requêtes par mots-clés (les domaines médicaux, ex. "Glaucoma").
+    """
+    from lexical_index import BM25Index
+    from text_utils import fold_question
+
+    corpus = load_corpus(args.csv)
+    if args.limit:
+        corpus = corpus.iloc[:args.limit]
+    index = load_search_index(args.export)
+    start = time.perf_counter()
+    lexical_index = BM25Index(index.documents)
+    print(f"Index BM25 construit en {time.perf_counter() - start:.1f}s : {len(lexical_index.vocabulary)} termes")
+
+    questions = corpus['question'].tolist()
+    keywords = sorted({str(doc.metadata.get("focus_area", "")) for doc in index.documents} - {""})
+    summary, details = {}, []
+    for name, queries, cache_path, is_expected in (
+        ("questions", questions, args.query_embeddings,
+         lambda query, doc: fold_question(doc.page_content) == fold_question(query)),
+        ("keywords", keywords, f"eval_keyword_embeddings_{EMBEDDING_BACKEND}.npy",
+         lambda query, doc: doc.metadata.get("focus_area") == query),
+    ):
+        query_vectors = embed_questions(queries, cache_path, args.batch_size)
+        set_summary, set_details = evaluate_hybrid(name, queries, is_expected, index, query_vectors, lexical_index)
+        summary.update(set_summary)
+        details.append(set_details)
+
+    write_results(args.out, summary, pd.concat(details, ignore_index=True))
+    for metric, value in summary.items():
+        print(f"{metric}: {value:.4f}" if isinstance(value, float) else f"{metric}: {value}")
+    print(f"Résultats écrits dans {args.out}.json et {args.out}.csv")
+
+def api_main(args):
+    samples = load_random_samples(args.samples)
     results = []
     for _, row in samples.iterrows():
         question = row['question']
@@ -85,7 +327,41 @@ def main():
             "chatbot_response": chatbot_response,
             **metrics
         })
+    # Pertinence calculée en une opération, avec un vectoriseur ajusté sur tout le corpus de réponses
+    scorer = CorpusScorer(load_corpus()['answer'])
+    relevance = calculate_relevance_batch([r["chatbot_response"] for r in results], [r["true_answer"] for r in results], scorer)
+    for result, score in zip(results, relevance):
+        result["relevance_score"] = float(score)
     display_evaluation_results(results)
 
+def main():
+    parser = argparse.ArgumentParser(description="Évaluation de SorakaBot")
+    parser.add_argument("--samples", type=int, default=10, help="Questions envoyées à l'API déployée")
+    subparsers = parser.add_subparsers(dest="command")
+
+    corpus = subparsers.add_parser("corpus", help="Recherche et pertinence sur tout medquad.csv, sans l'API")
+    corpus.add_argument("--csv", default=CSV_PATH)
+    corpus.add_argument("--export", default="medical_qa_export", help="Export de la table (ingest.py export)")
+    corpus.add_argument("--query-embeddings", default=f"eval_query_embeddings_{EMBEDDING_BACKEND}.npy", help="Cache des embeddings des questions (par backend)")
+    corpus.add_argument("--batch-size", type=int, default=250)
+    corpus.add_argument("--limit", type=int, help="N'évaluer que les premières questions")
+    corpus.add_argument("--out", default="eval_corpus")
+
+    lexical = subparsers.add_parser("lexical", help="Recherche vectorielle seule contre hybride (BM25 + RRF), sans l'API")
+    lexical.add_argument("--csv", default=CSV_PATH)
+    lexical.add_argument("--export", default="medical_qa_export", help="Export de la table (ingest.py export)")
+    lexical.add_argument("--query-embeddings", default=f"eval_query_embeddings_{EMBEDDING_BACKEND}.npy", help="Cache des embeddings des questions (par backend)")
+    lexical.add_argument("--batch-size", type=int, default=250)
+    lexical.add_argument("--limit", type=int, help="N'évaluer que les premières questions")
+    lexical.add_argument("--out", default="eval_lexical")
+
+    args = parser.parse_args()
+    if args.command == "corpus":
+        corpus_main(args)
+    elif args.command == "lexical":
+        lexical_main(args)
+    else:
+        api_main(args)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
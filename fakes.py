@@ -0,0 +1,211 @@
+"""
+Doublures locales des services externes (Vertex AI, Cloud SQL, Gemini).
+
+Elles reproduisent les contrats utilisés par l'API (embedding, recherche
+`(Document, score)` en distance cosinus, chaîne LangChain) avec une latence
+simulée, pour lancer les benchmarks hors ligne.
+"""
+import asyncio
+import math
+import random
+import time
+from typing import Any, AsyncIterator, List, Optional
+
+from langchain_core.documents.base import Document
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from config import EMBEDDING_SIZE
+from embedding_backends import HashingEmbeddings
+
+SAMPLE_QA = [
+    ("What is (are) Glaucoma ?", "Glaucoma is a group of diseases that can damage the eye's optic nerve.", "NIHSeniorHealth", "Glaucoma"),
+    ("What causes High Blood Pressure ?", "Blood pressure tends to rise with age and certain conditions.", "NIHSeniorHealth", "High Blood Pressure"),
+    ("What is (are) Diabetes ?", "Diabetes is a disease in which blood glucose levels are above normal.", "NIDDK", "Diabetes"),
+    ("What are the symptoms of Fever ?", "Fever is a temporary increase in body temperature.", "MPlusHealthTopics", "Fever"),
+    ("How to prevent Osteoporosis ?", "Calcium, vitamin D and exercise help prevent bone loss.", "NIHSeniorHealth", "Osteoporosis"),
+]
+
+
+def sample_documents(n: int = 50) -> List[Document]:
+    """
+    Génère n documents au format de la table medical_qa (question + métadonnées).
+    """
+    documents = []
+    for i in range(n):
+        question, answer, source, focus_area = SAMPLE_QA[i % len(SAMPLE_QA)]
+        if i >= len(SAMPLE_QA):
+            question = f"{question} ({i})"
+        documents.append(Document(
+            id=str(i),
+            page_content=question,
+            metadata={"answer": answer, "source": source, "focus_area": focus_area, "row_index": i},
+        ))
+    return documents
+
+
+def cosine_distance(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return 1.0 - dot / norm if norm else 1.0
+
+
+class FakeEmbeddings(HashingEmbeddings):
+    """
+    Embedding déterministe par hachage des mots, avec latence réseau simulée.
+    """
+
+    def __init__(self, size: int = EMBEDDING_SIZE, latency: float = 0.05):
+        super().__init__(size)
+        self.latency = latency
+        self.calls = 0
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+
+class FakeVectorStore:
+    """
+    Recherche exacte en distance cosinus sur une liste de documents, comme PostgresVectorStore.
+    """
+
+    def __init__(self, documents: List[Document], embedding: FakeEmbeddings, latency: float = 0.02):
+        self.documents = documents
+        self.embedding = embedding
+        self.latency = latency
+        self.calls = 0
+        self._vectors = [embedding._vector(doc.page_content) for doc in documents]
+
+    def _search(self, query_embedding: List[float], k: int, filter: Optional[dict] = None) -> List[tuple]:
+        self.calls += 1
+        # Filtre au format de PostgresVectorStore : {"colonne": {"$eq": valeur}}
+        conditions = {column: condition["$eq"] for column, condition in (filter or {}).items()}
+        scored = [(doc, cosine_distance(query_embedding, vector)) for doc, vector in zip(self.documents, self._vectors)
+                  if all(doc.metadata.get(column) == value for column, value in conditions.items())]
+        return sorted(scored, key=lambda x: x[1])[:k]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs) -> List[tuple]:
+        time.sleep(self.latency)
+        return self._search(self.embedding.embed_query(query), k, filter)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[dict] = None, **kwargs) -> List[tuple]:
+        time.sleep(self.latency)
+        return self._search(embedding, k, filter)
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[tuple]:
+        query_embedding = await self.embedding.aembed_query(query)
+        return await self.asimilarity_search_with_score_by_vector(query_embedding, k=k, **kwargs)
+
+    async def asimilarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                                      filter: Optional[dict] = None, **kwargs) -> List[tuple]:
+        await asyncio.sleep(self.latency)
+        return self._search(embedding, k, filter)
+
+
+class FakeServiceUnavailable(Exception):
+    """
+    Panne passagère du LLM, avec le code HTTP des exceptions google.api_core (ServiceUnavailable).
+    """
+
+    code = 503
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Modèle de chat qui répond un texte fixe après une latence simulée.
+
+    Des pannes peuvent être injectées : une proportion `error_rate` des appels échoue,
+    une proportion `slow_rate` prend `slow_latency` secondes au lieu de `latency`.
+    `latency_per_token` ajoute un coût proportionnel à la taille du prompt, dont
+    l'estimation en tokens est gardée dans `prompt_tokens`.
+    """
+
+    latency: float = 0.5
+    response: str = "Ceci est une réponse simulée de SorakaBot."
+    error_rate: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 10.0
+    latency_per_token: float = 0.0
+    calls: int = 0
+    prompt_tokens: List[int] = []
+
+    def _call_latency(self, messages: List[BaseMessage]) -> float:
+        # Tirage de la panne injectée pour cet appel
+        self.calls += 1
+        tokens = sum(len(str(message.content)) for message in messages) // 4
+        self.prompt_tokens.append(tokens)
+        if random.random() < self.error_rate:
+            raise FakeServiceUnavailable("Erreur simulée du LLM")
+        latency = self.slow_latency if random.random() < self.slow_rate else self.latency
+        return latency + self.latency_per_token * tokens
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs) -> ChatResult:
+        time.sleep(self._call_latency(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._call_latency(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        latency = self._call_latency(messages)
+        tokens = self.response.split(" ")
+        for i, token in enumerate(tokens):
+            await asyncio.sleep(latency / len(tokens))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token if i == 0 else f" {token}"))
+
+
+class FakeTranslator:
+    """
+    Traducteur du job hors ligne : préfixe la réponse du code de langue après une latence simulée.
+    Une proportion `error_rate` des appels échoue.
+    """
+
+    def __init__(self, latency: float = 0.5, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+
+    async def __call__(self, answer: str, language: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise RuntimeError("Erreur simulée de traduction")
+        return f"[{language}] {answer}"
+
+
+def install_fakes(api_module, embedding_latency: float = 0.05, search_latency: float = 0.02, llm_latency: float = 0.5, n_documents: int = 50) -> dict:
+    """
+    Remplace les services de l'API par des doublures et retourne ces doublures.
+    """
+    embedding = FakeEmbeddings(latency=embedding_latency)
+    vector_store = FakeVectorStore(sample_documents(n_documents), embedding, latency=search_latency)
+    llm = FakeChatModel(latency=llm_latency)
+    api_module.engine = object()
+    api_module.embedding = embedding
+    api_module.vector_store = vector_store
+    api_module.llm_gateway.set_client_factory(lambda model, temperature: llm)
+    return {"embedding": embedding, "vector_store": vector_store, "llm": llm}
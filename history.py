@@ -0,0 +1,125 @@
+"""
+Historique injecté dans les prompts, borné par un budget de tokens.
+
+Les messages les plus récents sont repris tels quels tant qu'ils tiennent dans
+le budget ; les plus anciens sont repliés dans un résumé glissant par session,
+gardé dans les métadonnées de la session. Le résumé est mis à jour en
+arrière-plan : une requête n'attend jamais sa génération et utilise le dernier
+résumé disponible.
+"""
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    # Environ 4 caractères par token pour Gemini en anglais comme en français
+    return (len(text) + 3) // 4
+
+
+def format_messages(messages: list[dict]) -> str:
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+
+
+def _fingerprint(message: dict) -> str:
+    return hashlib.sha256(f"{message['role']}\x1f{message['content']}".encode("utf-8")).hexdigest()[:16]
+
+
+class HistoryBuilder:
+    """
+    Construit le texte d'historique d'une session pour le prompt.
+
+    Args:
+        session_store: Stockage des sessions (historique et métadonnées).
+        summarize (Callable): Coroutine `summarize(summary, messages_text)` qui retourne le nouveau résumé.
+        token_budget (int): Budget de l'historique (résumé compris) ; 0 = les `max_messages` derniers messages, sans résumé.
+        max_messages (int): Nombre de messages repris sans budget.
+    """
+
+    def __init__(self, session_store, summarize: Callable[[str, str], Awaitable[str]], token_budget: int = 800,
+                 max_messages: int = 9):
+        self.session_store = session_store
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self._tasks = {}  # session_id -> résumé en cours
+        self.counters = {"summaries": 0, "failures": 0, "folded_messages": 0}
+
+    def build(self, session_id: str, messages: list[dict], meta: dict = None) -> str:
+        """
+        Texte d'historique pour les messages donnés (la question courante exclue).
+        `meta` : métadonnées de la session déjà lues par l'appelant, sinon lues ici.
+        """
+        if not self.token_budget:
+            return format_messages(messages[-self.max_messages:])
+
+        if meta is None:
+            meta = self.session_store.get_meta(session_id)
+        summary = meta.get("summary", "")
+        budget = self.token_budget - estimate_tokens(summary)
+
+        # Messages les plus récents tant qu'ils tiennent dans le budget
+        start, used = len(messages), 0
+        while start > 0:
+            cost = estimate_tokens(messages[start - 1]["content"]) + 2
+            if used + cost > budget:
+                break
+            used += cost
+            start -= 1
+
+        older = messages[:start]
+        pending = self._unsummarized(older, meta.get("summary_last"))
+        if pending:
+            self._schedule(session_id, pending)
+
+        parts = []
+        if summary:
+            parts.append(f"Résumé de la conversation précédente : {summary}")
+        recent = messages[start:]
+        if not recent and messages and budget > 0:
+            # Un seul message dépasse le budget : sa fin est gardée
+            last = messages[-1]
+            recent = [{"role": last["role"], "content": last["content"][-max(budget, 0) * 4:]}]
+        if recent:
+            parts.append(format_messages(recent))
+        return "\n".join(parts)
+
+    @staticmethod
+    def _unsummarized(older: list[dict], summary_last: Optional[str]) -> list[dict]:
+        # Le résumé couvre jusqu'au message d'empreinte summary_last ; s'il n'est plus dans
+        # l'historique (messages anciens évincés), tous les messages anciens restent à résumer
+        if summary_last:
+            for i in range(len(older) - 1, -1, -1):
+                if _fingerprint(older[i]) == summary_last:
+                    return older[i + 1:]
+        return older
+
+    def _schedule(self, session_id: str, pending: list[dict]):
+        # Un seul résumé à la fois par session ; les messages suivants attendent le prochain tour
+        task = self._tasks.get(session_id)
+        if task is not None and not task.done():
+            return
+        self._tasks[session_id] = asyncio.create_task(self._fold(session_id, pending))
+
+    async def _fold(self, session_id: str, pending: list[dict]):
+        try:
+            summary = (await self.session_store.aget_meta(session_id)).get("summary", "")
+            new_summary = await self.summarize(summary, format_messages(pending))
+            await self.session_store.aupdate_meta(session_id, summary=new_summary.strip(), summary_last=_fingerprint(pending[-1]))
+            self.counters["summaries"] += 1
+            self.counters["folded_messages"] += len(pending)
+        except Exception as e:
+            self.counters["failures"] += 1
+            print(f"Erreur de résumé de l'historique: {str(e)}")
+        finally:
+            self._tasks.pop(session_id, None)
+
+    async def wait_idle(self):
+        """
+        Attend la fin des résumés en cours (arrêt du serveur, benchmarks).
+        """
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_progress": len(self._tasks), "token_budget": self.token_budget}
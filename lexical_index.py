@@ -0,0 +1,159 @@
+"""
+Index lexical BM25 en mémoire sur les questions et réponses de medical_qa.
+
+Les listes de postings sont gardées en tableaux NumPy contigus (format CSR :
+début de chaque terme, documents, poids) : le poids BM25 de chaque couple
+(terme, document) est calculé une fois à la construction, et une recherche
+se réduit à quelques additions vectorisées par mot de la question.
+
+Les questions courtes par mots-clés ("fever", un nom de médicament) y sont
+retrouvées là où la recherche vectorielle donne un score médiocre.
+"""
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents.base import Document
+
+from ingest import afetch_documents
+from config import BM25_K1, BM25_B, BM25_QUESTION_WEIGHT, LEXICAL_MARGIN
+
+_TOKEN = re.compile(r"\w+")
+# Mots outils des questions de MedQuAD (et des questions en français), sans valeur de recherche
+STOPWORDS = frozenset("""
+a about am an and any are as at be can could do does for from get had has have how i if in is it its me my of on or
+should so than that the their them there these they this those to was what when where which who whom why will with
+would you your
+au aux ce ces comment de des du en est et la le les mon ma mes ou pour quand que quel quelle quels quelles qu qui
+sont sur un une
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    # Pluriel réduit au singulier (treatments -> treatment) : seule racinisation appliquée
+    return [token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+            for token in _TOKEN.findall(text.casefold()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Index inversé BM25 des documents de medical_qa (question pondérée + réponse).
+
+    Args:
+        documents (list[Document]): Les documents ; la réponse est lue dans metadata["answer"].
+        k1 (float): Saturation de la fréquence des termes.
+        b (float): Normalisation par la longueur du document.
+        question_weight (int): Poids d'une occurrence dans la question par rapport à la réponse.
+    """
+
+    def __init__(self, documents: List[Document], k1: float = BM25_K1, b: float = BM25_B,
+                 question_weight: int = BM25_QUESTION_WEIGHT):
+        self.documents = documents
+        self._partitions = {}
+        vocabulary = {}
+        term_ids, doc_ids, frequencies = [], [], []
+        lengths = np.zeros(len(documents), dtype=np.float32)
+        for position, doc in enumerate(documents):
+            counts = Counter()
+            for token in tokenize(doc.page_content):
+                counts[token] += question_weight
+            for token in tokenize(doc.metadata.get("answer", "")):
+                counts[token] += 1
+            lengths[position] = sum(counts.values())
+            for token, count in counts.items():
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                doc_ids.append(position)
+                frequencies.append(count)
+        self.vocabulary = vocabulary
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind="stable")
+        self._doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        tf = np.asarray(frequencies, dtype=np.float32)[order]
+        df = np.bincount(term_ids, minlength=len(vocabulary))
+        self._indptr = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+
+        # Poids BM25 de chaque posting, calculé une fois
+        n = max(len(documents), 1)
+        idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        average_length = float(lengths.mean()) if len(documents) else 1.0
+        norm = k1 * (1.0 - b + b * lengths[self._doc_ids] / max(average_length, 1e-9))
+        self._weights = (np.repeat(idf, df) * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32)
+        # Meilleur poids de chaque terme : borne de la confiance d'une recherche
+        self._term_max = np.maximum.reduceat(self._weights, self._indptr[:-1]) if len(self._weights) else self._weights
+
+    @classmethod
+    async def aload(cls, engine, table_name: str) -> "BM25Index":
+        """
+        Construit l'index à partir de la table (sans lire les vecteurs).
+        """
+        return cls(await afetch_documents(engine, table_name))
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def partition(self, filter: Dict[str, str]) -> np.ndarray:
+        """
+        Lignes dont les métadonnées valent `filter`, calculées une fois par filtre.
+        """
+        key = tuple(sorted(filter.items()))
+        rows = self._partitions.get(key)
+        if rows is None:
+            rows = np.array([i for i, doc in enumerate(self.documents)
+                             if all(doc.metadata.get(column) == value for column, value in filter.items())], dtype=np.int64)
+            self._partitions[key] = rows
+        return rows
+
+    def _scores(self, query: str) -> tuple:
+        # Scores BM25 de tous les documents et borne supérieure atteignable pour cette question
+        tokens = set(tokenize(query))
+        known = [self.vocabulary[token] for token in tokens if token in self.vocabulary]
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for term in known:
+            start, end = self._indptr[term], self._indptr[term + 1]
+            scores[self._doc_ids[start:end]] += self._weights[start:end]
+        bound = float(self._term_max[known].sum()) if known else 0.0
+        # Un mot absent du corpus compte dans la borne : la confiance baisse d'autant
+        coverage = len(known) / len(tokens) if tokens else 0.0
+        return scores, bound / coverage if coverage else 0.0
+
+    def search(self, query: str, k: int = 4, filter: Optional[Dict[str, str]] = None) -> List[tuple]:
+        """
+        Les k meilleurs documents avec leur confiance : score BM25 rapporté au meilleur score
+        atteignable pour chaque mot de la question (1 = meilleur document pour tous les mots).
+        """
+        scores, bound = self._scores(query)
+        if bound == 0.0:
+            return []
+        rows = None
+        if filter:
+            rows = self.partition(filter)
+            scores = scores[rows]
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) == 0:
+            return []
+        k = min(k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.documents[i if rows is None else rows[i]], float(scores[i]) / bound) for i in top]
+
+    def match(self, query: str, min_score: float, margin: float = LEXICAL_MARGIN,
+              filter: Optional[Dict[str, str]] = None) -> Optional[tuple]:
+        """
+        Le meilleur document s'il est sûr : tous les mots de la question figurent dans sa question
+        ou son domaine médical, confiance d'au moins `min_score` et avance relative d'au moins
+        `margin` sur le second ; None sinon.
+        """
+        if min_score <= 0:
+            return None
+        results = self.search(query, k=2, filter=filter)
+        if not results or results[0][1] < min_score:
+            return None
+        if len(results) > 1 and results[1][1] > results[0][1] * (1.0 - margin):
+            return None
+        doc = results[0][0]
+        if not set(tokenize(query)) <= set(tokenize(f"{doc.page_content} {doc.metadata.get('focus_area', '')}")):
+            return None
+        return results[0]
+
@@ -0,0 +1,325 @@
+"""
+Passerelle vers le LLM : clients réutilisés, prompts précompilés, délai maximal
+par requête, nouvelles tentatives avec backoff aléatoire, limite de concurrence
+et disjoncteur quand le service amont est en panne.
+"""
+import asyncio
+import random
+import time
+from typing import AsyncIterator, Callable
+
+from langchain_core.prompts import ChatPromptTemplate
+
+# Branche combined_response : une réponse de référence a été trouvée en base
+COMBINED_PROMPT = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        """Tu es SorakaBot, un assistant médical virtuel spécialisé.
+                        
+Voici l'historique de la conversation :
+{history}
+
+Voici une réponse de référence pour la question actuelle : {reference_answer}
+                        
+Utilise cette information et le contexte de la conversation pour répondre de manière précise à la question suivante en {language}.
+Sois concis et direct dans ta réponse.
+                        
+Question: {question}"""
+    ),
+    ("human", "{question}")
+])
+
+# Branche llm_response : pas de bonne correspondance, Gemini répond librement
+LLM_PROMPT = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        """Tu es SorakaBot, un assistant médical virtuel spécialisé.
+
+                Voici l'historique de la conversation :
+                {history}
+                            
+                Réponds à la question de manière claire et précise en {language}.
+                Base ta réponse sur tes connaissances médicales générales et le contexte de la conversation.
+                N'oublie pas de recommander de consulter un professionnel de santé si nécessaire.
+
+                Question: {question}"""
+    ),
+    ("human", "{question}")
+])
+
+# Résumé glissant de l'historique d'une session, calculé en arrière-plan
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        """Tu résumes une conversation entre un patient et SorakaBot, un assistant médical virtuel.
+
+Résumé actuel :
+{summary}
+
+Nouveaux échanges à intégrer :
+{messages}
+
+Écris un nouveau résumé de {max_words} mots au maximum qui conserve les symptômes, antécédents,
+traitements et questions du patient ainsi que les conseils déjà donnés."""
+    ),
+    ("human", "Résume la conversation.")
+])
+
+# Traduction hors ligne des réponses de référence (translations.py)
+TRANSLATION_PROMPT = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        """Tu traduis des réponses médicales de référence de l'anglais vers la langue demandée : {language}.
+Traduis fidèlement, sans résumer, sans rien ajouter ni retirer, en conservant les termes médicaux exacts.
+Réponds uniquement avec la traduction."""
+    ),
+    ("human", "{text}")
+])
+
+PROMPTS = {"combined": COMBINED_PROMPT, "llm": LLM_PROMPT, "summary": SUMMARY_PROMPT, "translation": TRANSLATION_PROMPT}
+
+
+def _remaining(deadline: float) -> float:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise asyncio.TimeoutError()
+    return remaining
+
+
+def is_transient(e: Exception) -> bool:
+    """
+    Échec passager du service amont, qui vaut une nouvelle tentative : délai dépassé,
+    quota (429) ou erreur serveur (5xx). Les autres erreurs (requête invalide, contenu
+    refusé, erreur de programmation) échoueraient de la même façon au prochain essai.
+    """
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    # Code HTTP des exceptions google.api_core (`code`) et des clients HTTP (`status_code`)
+    status = getattr(e, "code", None)
+    if not isinstance(status, int):
+        status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return isinstance(status, int) and (status == 429 or 500 <= status < 600)
+
+
+class CircuitOpenError(Exception):
+    """Le disjoncteur est ouvert : l'appel échoue immédiatement sans solliciter le LLM."""
+
+
+class CircuitBreaker:
+    """
+    S'ouvre après `failure_threshold` échecs consécutifs, laisse passer un appel
+    d'essai après `reset_timeout` secondes et se referme si cet appel réussit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        # Un seul appel d'essai à la fois ; un essai abandonné libère la place après reset_timeout
+        trial_pending = self._trial_started is not None and time.monotonic() - self._trial_started < self.reset_timeout
+        if state == "open" or (state == "half_open" and trial_pending):
+            raise CircuitOpenError("Service LLM indisponible (disjoncteur ouvert)")
+        if state == "half_open":
+            self._trial_started = time.monotonic()
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_started = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class LLMGateway:
+    """
+    Point d'entrée unique des appels au LLM.
+
+    Args:
+        client_factory (Callable): Construit un client de chat, appelée avec `model` et `temperature`.
+        model (str): Nom du modèle.
+        timeout (float): Délai maximal d'une requête, nouvelles tentatives comprises (secondes).
+        max_retries (int): Nombre de nouvelles tentatives après un échec.
+        backoff_base (float): Attente de base avant une nouvelle tentative, doublée à chaque essai.
+        backoff_max (float): Attente maximale entre deux tentatives.
+        max_concurrency (int): Nombre maximal d'appels simultanés dans le worker.
+        breaker (CircuitBreaker, optional): Disjoncteur partagé par tous les appels.
+    """
+
+    def __init__(self, client_factory: Callable, model: str = "gemini-1.5-pro", timeout: float = 20.0,
+                 max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 4.0,
+                 max_concurrency: int = 16, breaker: CircuitBreaker = None):
+        self.client_factory = client_factory
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._semaphore_loop = None
+        self._clients = {}
+        self._chains = {}
+        self.counters = {"calls": 0, "retries": 0, "timeouts": 0, "failures": 0, "errors": 0, "rejected": 0}
+
+    def set_client_factory(self, client_factory: Callable):
+        """
+        Remplace la fabrique de clients et oublie les clients déjà construits.
+        """
+        self.client_factory = client_factory
+        self._clients.clear()
+        self._chains.clear()
+
+    def client(self, temperature: float):
+        """
+        Client de chat réutilisé, un par (modèle, température).
+        """
+        key = (self.model, round(temperature, 2))
+        client = self._clients.get(key)
+        if client is None:
+            client = self.client_factory(model=self.model, temperature=temperature)
+            self._clients[key] = client
+        return client
+
+    def chain(self, kind: str, temperature: float):
+        """
+        Chaîne prompt précompilé | client, construite une fois par (prompt, modèle, température).
+        """
+        key = (kind, self.model, round(temperature, 2))
+        chain = self._chains.get(key)
+        if chain is None:
+            chain = PROMPTS[kind] | self.client(temperature)
+            self._chains[key] = chain
+        return chain
+
+    def _loop_semaphore(self) -> asyncio.Semaphore:
+        # Sémaphore créé sur la boucle qui l'utilise : un sémaphore reste lié à sa première boucle
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _acquire(self, deadline: float) -> asyncio.Semaphore:
+        # L'attente d'une place compte dans le délai de la requête ; un délai dépassé pendant
+        # cette attente locale ne dit rien du service amont et n'est pas compté par le disjoncteur
+        semaphore = self._loop_semaphore()
+        try:
+            timeout = _remaining(deadline)
+            await asyncio.wait_for(semaphore.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise
+        return semaphore
+
+    def _backoff(self, attempt: int) -> float:
+        # Backoff exponentiel avec gigue complète
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _check_breaker(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.counters["rejected"] += 1
+            raise
+
+    async def ainvoke(self, kind: str, temperature: float, inputs: dict) -> str:
+        """
+        Génère une réponse complète et retourne son texte.
+        """
+        deadline = time.monotonic() + self.timeout
+        chain = self.chain(kind, temperature)
+        attempt = 0
+        while True:
+            self._check_breaker()
+            self.counters["calls"] += 1
+            semaphore = await self._acquire(deadline)
+            try:
+                try:
+                    response = await asyncio.wait_for(chain.ainvoke(inputs), timeout=_remaining(deadline))
+                finally:
+                    semaphore.release()
+                self.breaker.record_success()
+                return response.content
+            except Exception as e:
+                transient = self._record_error(e)
+                delay = self._backoff(attempt)
+                if not transient or attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                self.counters["retries"] += 1
+                await asyncio.sleep(delay)
+
+    async def astream(self, kind: str, temperature: float, inputs: dict) -> AsyncIterator[str]:
+        """
+        Génère une réponse fragment par fragment. Une nouvelle tentative n'est possible
+        que tant qu'aucun fragment n'a été transmis.
+        """
+        deadline = time.monotonic() + self.timeout
+        chain = self.chain(kind, temperature)
+        attempt = 0
+        while True:
+            self._check_breaker()
+            self.counters["calls"] += 1
+            started = False
+            semaphore = await self._acquire(deadline)
+            try:
+                try:
+                    stream = chain.astream(inputs).__aiter__()
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(stream.__anext__(), timeout=_remaining(deadline))
+                            except StopAsyncIteration:
+                                break
+                            if chunk.content:
+                                started = True
+                                yield chunk.content
+                    finally:
+                        # Flux abandonné (délai, erreur, client parti) : fermé tout de suite avec sa connexion
+                        await stream.aclose()
+                finally:
+                    semaphore.release()
+                self.breaker.record_success()
+                return
+            except Exception as e:
+                transient = self._record_error(e)
+                delay = self._backoff(attempt)
+                if not transient or started or attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                self.counters["retries"] += 1
+                await asyncio.sleep(delay)
+
+    def _record_error(self, e: Exception) -> bool:
+        # Seuls les échecs passagers comptent pour le disjoncteur et sont retentés ; une autre
+        # erreur est une réponse du service amont, qui reste donc joignable
+        if not is_transient(e):
+            self.counters["errors"] += 1
+            self.breaker.record_success()
+            return False
+        if isinstance(e, asyncio.TimeoutError):
+            self.counters["timeouts"] += 1
+        self.counters["failures"] += 1
+        self.breaker.record_failure()
+        return True
+
+    def stats(self) -> dict:
+        return {**self.counters, "circuit": self.breaker.state, "clients": len(self._chains)}
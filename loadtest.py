@@ -0,0 +1,207 @@
+"""
+Test de charge de /answer : latences p50/p90/p99/max, taux d'erreur et débit
+par type de réponse (combined_response, llm_response).
+
+Deux modes d'injection :
+- boucle fermée (--concurrency N) : N clients enchaînent leurs requêtes ;
+- boucle ouverte (--qps R) : les requêtes partent à cadence fixe (arrivées de
+  Poisson), qu'elles aient ou non reçu leur réponse, comme du vrai trafic.
+
+Avec --in-process, l'application FastAPI est exécutée dans le processus avec
+les doublures de `fakes.py` (embedding, recherche, LLM) : aucun accès réseau.
+
+Usage :
+    python loadtest.py --url https://.../answer --concurrency 20 --duration 60
+    python loadtest.py --url http://127.0.0.1:8181/answer --qps 10 --duration 60 --warmup 10
+    python loadtest.py --in-process --concurrency 50 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+from eval import API_URL, build_payload, load_random_samples, parse_chatbot_response
+
+# Questions hors corpus pour le mode --in-process : elles passent par la branche llm_response
+OFF_CORPUS_QUESTIONS = [
+    "How long should I rest after a marathon ?",
+    "Is it safe to drink coffee every day ?",
+    "What should I pack for a hiking trip ?",
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class LoadRecorder:
+    """
+    Résultats des requêtes envoyées après la phase de préchauffage.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)  # type de réponse -> latences (secondes)
+        self.errors = defaultdict(int)  # type d'erreur -> nombre
+        self.recording = False
+
+    def record(self, response_type: str, latency: float):
+        if self.recording:
+            self.latencies[response_type].append(latency)
+
+    def record_error(self, kind: str):
+        if self.recording:
+            self.errors[kind] += 1
+
+    def report(self, duration: float) -> dict:
+        total = sum(len(values) for values in self.latencies.values()) + sum(self.errors.values())
+        report = {
+            "duration": duration,
+            "requests": total,
+            "throughput": total / duration if duration else 0.0,
+            "error_rate": sum(self.errors.values()) / total if total else 0.0,
+            "errors": dict(self.errors),
+            "types": {},
+        }
+        for response_type, values in sorted(self.latencies.items()):
+            report["types"][response_type] = {
+                "count": len(values),
+                "throughput": len(values) / duration if duration else 0.0,
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "max": max(values),
+            }
+        return report
+
+
+async def send_request(client: httpx.AsyncClient, url: str, question: str, recorder: LoadRecorder):
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, json=build_payload(question))
+        latency = time.perf_counter() - start
+        if response.status_code != 200:
+            recorder.record_error(f"http_{response.status_code}")
+            return
+        json_data = response.json()
+        # /answer répond 200 avec un champ "error" quand le traitement échoue
+        if "error" in json_data:
+            recorder.record_error("api_error")
+            return
+        recorder.record(parse_chatbot_response(json_data, latency)["type"], latency)
+    except httpx.TimeoutException:
+        recorder.record_error("timeout")
+    except Exception:
+        recorder.record_error("exception")
+
+
+async def closed_loop(client, url: str, questions: list[str], recorder: LoadRecorder, concurrency: int, end: float):
+    async def worker():
+        while time.perf_counter() < end:
+            await send_request(client, url, random.choice(questions), recorder)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def open_loop(client, url: str, questions: list[str], recorder: LoadRecorder, qps: float, end: float):
+    tasks = set()
+    next_send = time.perf_counter()
+    while next_send < end:
+        await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+        task = asyncio.create_task(send_request(client, url, random.choice(questions), recorder))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        next_send += random.expovariate(qps)
+    # Les requêtes parties avant la fin sont attendues et comptées
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def run_load(client, url: str, questions: list[str], concurrency: int = None, qps: float = None,
+                   duration: float = 30.0, warmup: float = 5.0) -> dict:
+    """
+    Préchauffage de `warmup` secondes (non mesuré), puis charge mesurée pendant `duration` secondes.
+    """
+    recorder = LoadRecorder()
+
+    async def phase(seconds: float):
+        end = time.perf_counter() + seconds
+        if qps:
+            await open_loop(client, url, questions, recorder, qps, end)
+        else:
+            await closed_loop(client, url, questions, recorder, concurrency, end)
+
+    if warmup > 0:
+        await phase(warmup)
+    recorder.recording = True
+    start = time.perf_counter()
+    await phase(duration)
+    return recorder.report(time.perf_counter() - start)
+
+
+def in_process_client(llm_latency: float, embedding_latency: float, search_latency: float) -> tuple:
+    """
+    Client HTTP branché directement sur l'application FastAPI, services remplacés par des doublures.
+    """
+    os.environ.setdefault("DB_PASSWORD", "")  # ingest.py lit le mot de passe à l'import
+    import api
+    from fakes import install_fakes
+
+    fakes = install_fakes(api, embedding_latency=embedding_latency, search_latency=search_latency, llm_latency=llm_latency)
+    questions = [doc.page_content for doc in fakes["vector_store"].documents] + OFF_CORPUS_QUESTIONS
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://sorakabot", timeout=60)
+    return client, "/answer", questions
+
+
+def print_report(report: dict):
+    print(f"{report['requests']} requêtes en {report['duration']:.1f}s : "
+          f"{report['throughput']:.2f} req/s, taux d'erreur {report['error_rate']:.1%}")
+    if report["errors"]:
+        print("Erreurs : " + ", ".join(f"{kind}={count}" for kind, count in report["errors"].items()))
+    print(f"{'type':>18} {'requêtes':>9} {'req/s':>8} {'p50 (ms)':>9} {'p90 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}")
+    for response_type, line in report["types"].items():
+        print(f"{response_type:>18} {line['count']:>9} {line['throughput']:>8.2f} {line['p50'] * 1000:>9.1f} "
+              f"{line['p90'] * 1000:>9.1f} {line['p99'] * 1000:>9.1f} {line['max'] * 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'API SorakaBot")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=10, help="Boucle fermée : nombre de clients")
+    load.add_argument("--qps", type=float, help="Boucle ouverte : requêtes par seconde")
+    parser.add_argument("--duration", type=float, default=30.0, help="Durée mesurée (secondes)")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Préchauffage non mesuré (secondes)")
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--questions", type=int, default=200, help="Questions tirées de medquad.csv")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--in-process", action="store_true", help="Application et services simulés dans le processus")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--search-latency", type=float, default=0.02)
+    parser.add_argument("--json", action="store_true", help="Rapport au format JSON")
+    args = parser.parse_args()
+
+    async def run():
+        if args.in_process:
+            client, url, questions = in_process_client(args.llm_latency, args.embedding_latency, args.search_latency)
+        else:
+            client = httpx.AsyncClient(timeout=args.timeout, limits=httpx.Limits(max_connections=None))
+            url, questions = args.url, load_random_samples(args.questions)["question"].tolist()
+        async with client:
+            return await run_load(client, url, questions, concurrency=args.concurrency, qps=args.qps,
+                                  duration=args.duration, warmup=args.warmup)
+
+    report = asyncio.run(run())
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
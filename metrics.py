@@ -0,0 +1,119 @@
+"""
+Métriques Prometheus de l'API : durée de chaque étape d'une requête (recherche
+lexicale, embedding, recherche vectorielle, construction du prompt, appel LLM,
+sérialisation),
+branche de réponse choisie, erreurs, et compteurs déjà tenus par les caches
+et le stockage des sessions, lus au moment de la collecte.
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from config import METRICS_ENABLED
+
+STAGES = ("session", "lexical_search", "embedding", "vector_search", "prompt_build", "llm", "serialization")
+# Du cache local (sous la milliseconde) jusqu'aux générations Gemini les plus longues
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+STAGE_SECONDS = Histogram("sorakabot_stage_seconds", "Durée d'une étape du traitement d'une question", ["stage"], buckets=_BUCKETS)
+REQUEST_SECONDS = Histogram("sorakabot_request_seconds", "Durée totale d'une requête", ["endpoint"], buckets=_BUCKETS)
+RESPONSES = Counter("sorakabot_responses", "Réponses par niveau (extractive, combined, llm)", ["type"])
+ERRORS = Counter("sorakabot_errors", "Requêtes en erreur", ["endpoint"])
+RETRIEVALS = Counter("sorakabot_retrievals", "Document retenu par méthode (exact, lexical, vector, hybrid)", ["method"])
+ADMISSIONS = Counter("sorakabot_admissions", "Requêtes servies en mode dégradé ou refusées (503) par le contrôle d'admission", ["outcome"])
+TIER_SECONDS = Histogram("sorakabot_tier_seconds", "Durée d'une requête selon le niveau qui l'a servie", ["tier"], buckets=_BUCKETS)
+
+# Séries résolues une fois : pas de recherche de labels sur le chemin critique
+_STAGE_HISTOGRAMS = {stage: STAGE_SECONDS.labels(stage=stage) for stage in STAGES}
+
+enabled = METRICS_ENABLED
+
+
+class RequestTimer:
+    """
+    Durées des étapes d'une requête, pour le détail optionnel renvoyé dans `metadata`.
+    """
+
+    __slots__ = ("stages",)
+
+    def __init__(self):
+        self.stages = {}
+
+    def record(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def breakdown(self) -> dict:
+        return {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}  # millisecondes
+
+
+@contextmanager
+def timed(stage: str, timer: Optional[RequestTimer] = None):
+    """
+    Mesure le bloc : histogramme de l'étape et, si fourni, détail de la requête.
+    """
+    if not enabled and timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if enabled:
+            _STAGE_HISTOGRAMS[stage].observe(elapsed)
+        if timer is not None:
+            timer.record(stage, elapsed)
+
+
+class StatsCollector:
+    """
+    Expose à chaque collecte les compteurs des caches, de l'index des questions
+    et des sessions, à partir du dictionnaire renvoyé par `source` (celui de /stats).
+    """
+
+    CACHES = ("embedding_cache", "response_cache", "question_index", "translations")
+
+    def __init__(self, source: Callable[[], dict]):
+        self.source = source
+
+    def describe(self):
+        # Sans describe(), REGISTRY.register() appelle collect() dès l'enregistrement, à l'import de l'API
+        return []
+
+    def collect(self):
+        stats = self.source()
+        hits = CounterMetricFamily("sorakabot_cache_hits", "Succès des caches", labels=["cache"])
+        misses = CounterMetricFamily("sorakabot_cache_misses", "Échecs des caches", labels=["cache"])
+        for cache in self.CACHES:
+            if stats.get(cache):
+                hits.add_metric([cache], stats[cache]["hits"])
+                misses.add_metric([cache], stats[cache]["misses"])
+        yield hits
+        yield misses
+        if stats.get("sessions"):
+            yield GaugeMetricFamily("sorakabot_active_sessions", "Sessions conservées", value=stats["sessions"]["sessions"])
+        if stats.get("llm_gateway"):
+            llm = CounterMetricFamily("sorakabot_llm_events", "Appels, nouvelles tentatives et échecs de la passerelle LLM", labels=["event"])
+            for event, count in stats["llm_gateway"].items():
+                if isinstance(count, int):
+                    llm.add_metric([event], count)
+            yield llm
+        if stats.get("admission"):
+            admission = stats["admission"]
+            yield GaugeMetricFamily("sorakabot_admission_limit", "Limite de concurrence adaptative", value=admission["limit"])
+            yield GaugeMetricFamily("sorakabot_admission_in_flight", "Requêtes en cours de traitement", value=admission["in_flight"])
+            yield GaugeMetricFamily("sorakabot_admission_queued", "Requêtes en attente d'une place", value=admission["queued_now"])
+
+
+def register_stats_collector(source: Callable[[], dict]):
+    REGISTRY.register(StatsCollector(source))
+
+
+def render() -> tuple[bytes, str]:
+    """
+    Corps et type de contenu de la réponse /metrics.
+    """
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
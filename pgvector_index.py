@@ -0,0 +1,190 @@
+"""
+Gestion de l'index pgvector de medical_qa : création, suppression, reconstruction
+et balayage rappel/latence des paramètres de recherche.
+
+Usage :
+    python pgvector_index.py status
+    python pgvector_index.py create --type hnsw --m 16 --ef-construction 64
+    python pgvector_index.py rebuild --type ivfflat --lists 20
+    python pgvector_index.py drop
+    python pgvector_index.py sweep --type hnsw --values 10 20 40 80 160
+
+Chaque commande accepte --database-url pour viser un PostgreSQL local au lieu de Cloud SQL.
+Le paramètre retenu après le balayage se règle par HNSW_EF_SEARCH ou IVFFLAT_PROBES.
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from sqlalchemy import text
+from langchain_core.embeddings import Embeddings
+from langchain_google_cloud_sql_pg import PostgresEngine
+
+from ingest import (
+    create_cloud_sql_database_connection_async, create_local_database_connection, get_vector_store_async,
+    vector_index_definition, vector_query_options
+)
+from vector_index import InMemoryVectorIndex
+from config import TABLE_NAME, PGVECTOR_INDEX_TYPE, HNSW_M, HNSW_EF_CONSTRUCTION, IVFFLAT_LISTS
+
+# Valeurs balayées par défaut : ef_search pour HNSW, probes pour IVFFlat
+DEFAULT_SWEEP = {"hnsw": [10, 20, 40, 80, 160, 320], "ivfflat": [1, 2, 5, 10, 20, 50]}
+
+
+class _NoEmbeddings(Embeddings):
+    # La gestion de l'index et le balayage passent des vecteurs : aucun appel d'embedding
+    def embed_documents(self, texts):
+        raise NotImplementedError("pgvector_index.py ne calcule pas d'embedding")
+
+    def embed_query(self, text):
+        raise NotImplementedError("pgvector_index.py ne calcule pas d'embedding")
+
+
+async def _row_count(engine: PostgresEngine, table_name: str) -> int:
+    async with engine._pool.connect() as conn:
+        return (await conn.execute(text(f'SELECT COUNT(*) FROM "{table_name}"'))).scalar()
+
+
+async def index_status(engine: PostgresEngine, table_name: str) -> list[dict]:
+    """
+    Index pgvector existants sur la table, avec leur définition et leur taille.
+    """
+    async with engine._pool.connect() as conn:
+        result = await conn.execute(text(
+            "SELECT indexname, indexdef, pg_size_pretty(pg_relation_size(quote_ident(indexname)::regclass)) AS size "
+            "FROM pg_indexes WHERE tablename = :table AND (indexdef ILIKE '%USING hnsw%' OR indexdef ILIKE '%USING ivfflat%')"
+        ), {"table": table_name})
+        return [dict(row) for row in result.mappings()]
+
+
+async def create_index(engine: PostgresEngine, table_name: str, index_type: str = PGVECTOR_INDEX_TYPE,
+                       m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION, lists: int = IVFFLAT_LISTS,
+                       concurrently: bool = False) -> float:
+    """
+    Crée l'index vectoriel de la table et retourne sa durée de construction (secondes).
+    """
+    if index_type == "ivfflat" and not lists:
+        lists = max(1, await _row_count(engine, table_name) // 1000)
+    vector_store = await get_vector_store_async(engine, table_name, _NoEmbeddings())
+    if await vector_store.ais_valid_index():
+        raise ValueError(f"Un index vectoriel existe déjà sur {table_name} : utiliser rebuild ou drop")
+    start = time.perf_counter()
+    await vector_store.aapply_vector_index(
+        vector_index_definition(index_type, m=m, ef_construction=ef_construction, lists=lists),
+        concurrently=concurrently
+    )
+    async with engine._pool.connect() as conn:
+        await conn.execute(text(f'ANALYZE "{table_name}"'))
+        await conn.commit()
+    return time.perf_counter() - start
+
+
+async def drop_index(engine: PostgresEngine, table_name: str):
+    vector_store = await get_vector_store_async(engine, table_name, _NoEmbeddings())
+    await vector_store.adrop_vector_index()
+
+
+async def rebuild_index(engine: PostgresEngine, table_name: str, **params) -> float:
+    """
+    Supprime puis recrée l'index vectoriel, pour changer de type ou de paramètres de construction.
+    """
+    await drop_index(engine, table_name)
+    return await create_index(engine, table_name, **params)
+
+
+async def sweep(engine: PostgresEngine, table_name: str, index_type: str, values: list[int],
+                queries: int = 200, k: int = 4, noise: float = 0.01) -> list[dict]:
+    """
+    Pour chaque valeur de ef_search (HNSW) ou probes (IVFFlat), mesure le rappel@k
+    contre la recherche exacte en mémoire et les latences p50/p95 de pgvector.
+
+    Les requêtes sont des vecteurs de la table légèrement bruités.
+    """
+    index = await InMemoryVectorIndex.aload(engine, table_name)
+    rng = np.random.default_rng(42)
+    rows = rng.choice(len(index), size=min(queries, len(index)), replace=False)
+    query_vectors = [(index._matrix[i] + rng.normal(0, noise, index._matrix.shape[1])).tolist() for i in rows]
+    expected = [{doc.id for doc, _ in index.similarity_search_with_score_by_vector(query, k=k)} for query in query_vectors]
+
+    report = []
+    for value in values:
+        vector_store = await get_vector_store_async(
+            engine, table_name, _NoEmbeddings(), index_query_options=vector_query_options(index_type, value)
+        )
+        times, recalls = [], []
+        for query, exact in zip(query_vectors, expected):
+            start = time.perf_counter()
+            results = await vector_store.asimilarity_search_with_score_by_vector(query, k=k)
+            times.append(time.perf_counter() - start)
+            recalls.append(len({doc.id for doc, _ in results} & exact) / len(exact))
+        times.sort()
+        report.append({
+            "value": value,
+            "recall": sum(recalls) / len(recalls),
+            "p50": times[len(times) // 2],
+            "p95": times[min(len(times) - 1, int(len(times) * 0.95))],
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gestion de l'index pgvector de medical_qa")
+    parser.add_argument("--database-url", help="PostgreSQL local (postgresql+asyncpg://...) au lieu de Cloud SQL")
+    parser.add_argument("--table", default=TABLE_NAME)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="Lister les index vectoriels de la table")
+    for name, help in (("create", "Créer l'index vectoriel"), ("rebuild", "Supprimer puis recréer l'index vectoriel")):
+        command = subparsers.add_parser(name, help=help)
+        command.add_argument("--type", choices=["hnsw", "ivfflat"], default=PGVECTOR_INDEX_TYPE)
+        command.add_argument("--m", type=int, default=HNSW_M)
+        command.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+        command.add_argument("--lists", type=int, default=IVFFLAT_LISTS, help="Par défaut : lignes / 1000")
+        command.add_argument("--concurrently", action="store_true", help="Construire sans bloquer les écritures")
+    subparsers.add_parser("drop", help="Supprimer l'index vectoriel")
+
+    sweep_parser = subparsers.add_parser("sweep", help="Rappel@k et latence pour chaque valeur de ef_search ou probes")
+    sweep_parser.add_argument("--type", choices=["hnsw", "ivfflat"], default=PGVECTOR_INDEX_TYPE)
+    sweep_parser.add_argument("--values", type=int, nargs="+")
+    sweep_parser.add_argument("--queries", type=int, default=200)
+    sweep_parser.add_argument("--k", type=int, default=4)
+    sweep_parser.add_argument("--noise", type=float, default=0.01)
+
+    args = parser.parse_args()
+
+    async def run():
+        if args.database_url:
+            engine = create_local_database_connection(args.database_url)
+        else:
+            engine = await create_cloud_sql_database_connection_async()
+
+        if args.command == "status":
+            indexes = await index_status(engine, args.table)
+            for index in indexes:
+                print(f"{index['indexname']} ({index['size']}) : {index['indexdef']}")
+            if not indexes:
+                print(f"Aucun index vectoriel sur {args.table} : les recherches font un parcours séquentiel")
+        elif args.command in ("create", "rebuild"):
+            build = create_index if args.command == "create" else rebuild_index
+            duration = await build(
+                engine, args.table, index_type=args.type, m=args.m, ef_construction=args.ef_construction,
+                lists=args.lists, concurrently=args.concurrently
+            )
+            print(f"Index {args.type} construit sur {args.table} en {duration:.1f}s")
+        elif args.command == "drop":
+            await drop_index(engine, args.table)
+            print(f"Index vectoriel de {args.table} supprimé")
+        else:
+            parameter = "ef_search" if args.type == "hnsw" else "probes"
+            report = await sweep(engine, args.table, args.type, args.values or DEFAULT_SWEEP[args.type],
+                                 queries=args.queries, k=args.k, noise=args.noise)
+            print(f"{parameter:>10} {f'rappel@{args.k}':>10} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+            for line in report:
+                print(f"{line['value']:>10} {line['recall']:>10.3f} {line['p50'] * 1000:>10.3f} {line['p95'] * 1000:>10.3f}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
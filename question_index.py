@@ -0,0 +1,84 @@
+"""
+Index exact des questions de medical_qa : une question déjà présente dans la
+base (casse, ponctuation et espaces repliés) est retrouvée sans embedding ni
+recherche vectorielle, avec un score de 0.
+"""
+import json
+import os
+from typing import List, Optional
+
+from langchain_core.documents.base import Document
+
+from ingest import afetch_documents
+from text_utils import fold_question
+
+
+class QuestionIndex:
+    """
+    Table de hachage question repliée -> document.
+
+    Args:
+        documents (list[Document]): Les documents de medical_qa ; en cas de doublon le premier est gardé.
+    """
+
+    def __init__(self, documents: List[Document]):
+        self._documents = {}
+        for doc in documents:
+            self._documents.setdefault(fold_question(doc.page_content), doc)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    async def aload(cls, engine, table_name: str) -> "QuestionIndex":
+        """
+        Construit l'index à partir de la table (sans lire les vecteurs).
+        """
+        return cls(await afetch_documents(engine, table_name))
+
+    @classmethod
+    def load(cls, path: str) -> "QuestionIndex":
+        """
+        Recharge un index écrit par `save`.
+        """
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        return cls([Document(id=r["id"], page_content=r["content"], metadata=r["metadata"]) for r in records])
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for doc in self._documents.values():
+                f.write(json.dumps({"id": doc.id, "content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, question: str) -> bool:
+        return fold_question(question) in self._documents
+
+    def lookup(self, question: str) -> Optional[Document]:
+        doc = self._documents.get(fold_question(question))
+        if doc is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return doc
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "questions": len(self._documents),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+async def aload_question_index(engine, table_name: str, path: Optional[str] = None) -> QuestionIndex:
+    """
+    Charge l'index depuis le fichier écrit à l'ingestion s'il existe, sinon depuis la table.
+    """
+    if path and os.path.exists(path):
+        return QuestionIndex.load(path)
+    return await QuestionIndex.aload(engine, table_name)
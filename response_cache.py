@@ -0,0 +1,154 @@
+"""
+Cache des réponses Gemini pour la branche combined_response (bonne correspondance en base).
+
+La clé combine le document trouvé, la langue, la température arrondie,
+la question normalisée et un condensé de l'historique de la session.
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from text_utils import normalize_question
+
+
+class MemoryBackend:
+    """
+    Stockage en mémoire du processus, éviction LRU au-delà de max_size.
+    """
+
+    def __init__(self, max_size: int = 5000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """
+    Stockage dans un fichier SQLite local, partagé entre redémarrages et workers.
+    Éviction des entrées les moins récemment lues au-delà de max_size.
+    """
+
+    blocking = True  # accès disque : appelé dans un thread par les variantes asynchrones
+
+    def __init__(self, path: str = "response_cache.sqlite3", max_size: int = 5000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at)")
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            return json.loads(row[0])
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, accessed_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,)
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    Façade du cache de réponses, indépendante du backend de stockage.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(doc_id: str, language: str, temperature: float, question: str, history: str = "") -> str:
+        # Historique non vide : la clé porte son condensé, une autre conversation ne la partage pas
+        history_digest = hashlib.sha256(history.encode("utf-8")).hexdigest() if history else ""
+        parts = [str(doc_id), language.casefold(), f"{round(temperature, 1):.1f}", normalize_question(question), history_digest]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def _count(self, value: Optional[dict]) -> Optional[dict]:
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._count(self.backend.get(key))
+
+    def set(self, key: str, value: dict):
+        self.backend.set(key, value)
+
+    async def aget(self, key: str) -> Optional[dict]:
+        """
+        Variante de `get` pour la boucle d'événements : un backend sur disque est lu dans un thread.
+        """
+        if getattr(self.backend, "blocking", False):
+            return self._count(await asyncio.to_thread(self.backend.get, key))
+        return self._count(self.backend.get(key))
+
+    async def aset(self, key: str, value: dict):
+        if getattr(self.backend, "blocking", False):
+            await asyncio.to_thread(self.backend.set, key, value)
+        else:
+            self.backend.set(key, value)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "size": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def create_response_cache(backend: str = "memory", max_size: int = 5000, path: str = "response_cache.sqlite3") -> ResponseCache:
+    """
+    Construit le cache de réponses avec le backend choisi ("memory" ou "sqlite").
+    """
+    if backend == "memory":
+        return ResponseCache(MemoryBackend(max_size=max_size))
+    if backend == "sqlite":
+        return ResponseCache(SQLiteBackend(path=path, max_size=max_size))
+    raise ValueError(f"Backend de cache de réponses inconnu : {backend}")
@@ -1,26 +1,226 @@
 import os
-from ingest import create_cloud_sql_database_connection, get_embeddings, get_vector_store
+from typing import Optional
+from ingest import create_cloud_sql_database_connection, get_cached_embeddings, get_vector_store, afetch_distances
 from langchain_google_cloud_sql_pg import PostgresVectorStore
 from langchain_core.documents.base import Document
-from config import TABLE_NAME
+from config import TABLE_NAME, SIMILARITY_THRESHOLD, LEXICAL_MATCH_SCORE, HYBRID_CANDIDATES, RRF_K
+from vector_index import InMemoryVectorIndex
+from question_index import QuestionIndex
+from lexical_index import BM25Index
+from metrics import RequestTimer, timed
 
-def get_relevant_documents(query: str, vector_store: PostgresVectorStore) -> list[Document]:
+def get_relevant_documents(query: str, vector_store: PostgresVectorStore, index: InMemoryVectorIndex = None,
+                           question_index: QuestionIndex = None, filter: Optional[dict] = None,
+                           timer: RequestTimer = None, lexical_index: BM25Index = None) -> list[Document]:
     """
     Retrieve the most relevant document based on a medical query using a vector store.
     
     Args:
         query (str): The medical question.
         vector_store (PostgresVectorStore): An instance of PostgresVectorStore.
+        index (InMemoryVectorIndex, optional): In-process index searched before Postgres.
+        question_index (QuestionIndex, optional): Exact-match index checked before any embedding.
+        filter (dict, optional): Metadata column values, e.g. {"focus_area": "Glaucoma"},
+            restricting the search to that partition (see `metadata_filter`).
+        timer (RequestTimer, optional): Receives the embedding and vector search durations.
+        lexical_index (BM25Index, optional): BM25 index fused with the vector hits, and
+            answering alone when it is confident (see `lexical_match`).
     
     Returns:
         list[Document]: A list containing only the most relevant document.
     """
-    # Utiliser similarity_search_with_score pour avoir les scores
-    results = vector_store.similarity_search_with_score(
-        query,
-        k=4  # On peut garder k=4 pour avoir un choix mais ne prendre que le meilleur
-    )
-    
+    exact_match = question_index.lookup(query) if question_index is not None else None
+    if exact_match is not None and matches_filter(exact_match, filter):
+        return [exact_match]
+
+    lexical_hit = lexical_match(query, lexical_index, filter, timer)
+    if lexical_hit is not None:
+        return [lexical_hit[0]]
+
+    with timed("embedding", timer):
+        query_embedding = vector_store.embeddings.embed_query(query)
+
+    k = HYBRID_CANDIDATES if lexical_index is not None else 4
+    with timed("vector_search", timer):
+        results = None
+        if _index_usable(index):
+            results = index.similarity_search_with_score_by_vector(query_embedding, k=k, filter=filter)
+        if not results:
+            # Utiliser similarity_search_with_score_by_vector pour avoir les scores
+            results = vector_store.similarity_search_with_score_by_vector(
+                query_embedding,
+                k=k,  # On peut garder k=4 pour avoir un choix mais ne prendre que le meilleur
+                **_pg_filter(filter)
+            )
+
+    if lexical_index is not None:
+        results = _fuse_lexical(query, query_embedding, results, index, lexical_index, filter, timer)
+        return [results[0][0]] if results else []
+    return _best_document(results)
+
+async def aget_relevant_documents(query: str, vector_store: PostgresVectorStore, index: InMemoryVectorIndex = None,
+                                  question_index: QuestionIndex = None, filter: Optional[dict] = None,
+                                  timer: RequestTimer = None, lexical_index: BM25Index = None) -> list[Document]:
+    """
+    Async version of `get_relevant_documents`: the embedding call and the
+    similarity search are awaited instead of blocking the event loop.
+
+    Args:
+        query (str): The medical question.
+        vector_store (PostgresVectorStore): An instance of PostgresVectorStore.
+        index (InMemoryVectorIndex, optional): In-process index searched before Postgres.
+        question_index (QuestionIndex, optional): Exact-match index checked before any embedding.
+        filter (dict, optional): Metadata column values restricting the search to that partition.
+        timer (RequestTimer, optional): Receives the embedding and vector search durations.
+        lexical_index (BM25Index, optional): BM25 index fused with the vector hits.
+
+    Returns:
+        list[Document]: A list containing only the most relevant document.
+    """
+    exact_match = question_index.lookup(query) if question_index is not None else None
+    if exact_match is not None and matches_filter(exact_match, filter):
+        return [exact_match]
+
+    lexical_hit = lexical_match(query, lexical_index, filter, timer)
+    if lexical_hit is not None:
+        return [lexical_hit[0]]
+
+    with timed("embedding", timer):
+        query_embedding = await vector_store.embeddings.aembed_query(query)
+    results = await asearch_hybrid(query, query_embedding, vector_store, k=4, index=index,
+                                   lexical_index=lexical_index, filter=filter, timer=timer)
+    if lexical_index is not None:
+        return [results[0][0]] if results else []
+    return _best_document(results)
+
+async def asearch_with_score(query_embedding: list[float], vector_store: PostgresVectorStore, k: int = 4,
+                             index: InMemoryVectorIndex = None, filter: Optional[dict] = None) -> list[tuple[Document, float]]:
+    """
+    Search by vector, in the in-process index when it is loaded and fresh,
+    falling back to Postgres otherwise or when the index has no result.
+
+    Both engines return `(Document, cosine distance)` pairs, smaller is closer.
+
+    Args:
+        query_embedding (list[float]): The embedded question.
+        vector_store (PostgresVectorStore): An instance of PostgresVectorStore.
+        k (int): Number of results.
+        index (InMemoryVectorIndex, optional): In-process index searched first.
+        filter (dict, optional): Metadata column values restricting the search to that partition.
+
+    Returns:
+        list[tuple[Document, float]]: The k closest documents with their scores.
+    """
+    if _index_usable(index):
+        results = await index.asimilarity_search_with_score_by_vector(query_embedding, k=k, filter=filter)
+        if results:
+            return results
+    return await vector_store.asimilarity_search_with_score_by_vector(query_embedding, k=k, **_pg_filter(filter))
+
+async def asearch_hybrid(query: str, query_embedding: list[float], vector_store: PostgresVectorStore, k: int = 4,
+                         index: InMemoryVectorIndex = None, lexical_index: BM25Index = None,
+                         filter: Optional[dict] = None, timer: RequestTimer = None, engine=None,
+                         table_name: str = TABLE_NAME) -> list[tuple[Document, float]]:
+    """
+    Vector search fused with the BM25 results by reciprocal-rank fusion when a lexical index is given,
+    plain `asearch_with_score` otherwise. The distance of a document found by BM25 only is read from
+    the in-memory index, or computed by pgvector on its primary key when `engine` is given.
+
+    Returns:
+        list[tuple[Document, float]]: Documents with their cosine distance, those under
+            SIMILARITY_THRESHOLD first, each group in fused order.
+    """
+    with timed("vector_search", timer):
+        results = await asearch_with_score(query_embedding, vector_store, k=HYBRID_CANDIDATES if lexical_index else k,
+                                           index=index, filter=filter)
+    if lexical_index is None:
+        return results
+    with timed("lexical_search", timer):
+        lexical_results = lexical_index.search(query, k=HYBRID_CANDIDATES, filter=filter)
+    distances = {}
+    if engine is not None and not _index_usable(index):
+        found = {document_id(doc) for doc, _ in results}
+        missing = [document_id(doc) for doc, _ in lexical_results if document_id(doc) not in found]
+        if missing:
+            try:
+                with timed("vector_search", timer):
+                    distances = await afetch_distances(engine, table_name, missing, query_embedding)
+            except Exception as e:
+                # Sans distance, ces documents gardent leur rang fusionné
+                print(f"Erreur de calcul des distances des documents lexicaux: {str(e)}")
+    return _fuse_lexical(query, query_embedding, results, index, lexical_index, filter, timer,
+                         lexical_results=lexical_results, distances=distances)
+
+def lexical_match(query: str, lexical_index: Optional[BM25Index], filter: Optional[dict] = None,
+                  timer: RequestTimer = None, min_score: float = LEXICAL_MATCH_SCORE) -> Optional[tuple[Document, float]]:
+    """
+    The BM25 best document when the lexical index is confident enough to skip the embedding
+    and vector search (see `BM25Index.match`), with its confidence; None otherwise.
+    """
+    if lexical_index is None or min_score <= 0:
+        return None
+    with timed("lexical_search", timer):
+        return lexical_index.match(query, min_score, filter=filter)
+
+def reciprocal_rank_fusion(rankings: list[list[tuple[Document, float]]], k: int = RRF_K) -> list[tuple[Document, float]]:
+    """
+    Merge rankings of `(Document, score)`: each document scores the sum of 1 / (k + rank) over the rankings.
+
+    Returns:
+        list[tuple[Document, float]]: Documents by decreasing fused score.
+    """
+    fused, documents = {}, {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            key = document_id(doc)
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(key, doc)
+    return sorted(((documents[key], score) for key, score in fused.items()), key=lambda item: -item[1])
+
+def _fuse_lexical(query: str, query_embedding: list[float], vector_results: list[tuple[Document, float]],
+                  index: Optional[InMemoryVectorIndex], lexical_index: BM25Index, filter: Optional[dict],
+                  timer: RequestTimer = None, lexical_results: list[tuple[Document, float]] = None,
+                  distances: Optional[dict] = None) -> list[tuple[Document, float]]:
+    with timed("lexical_search", timer):
+        if lexical_results is None:
+            lexical_results = lexical_index.search(query, k=HYBRID_CANDIDATES, filter=filter)
+        distances = {**(distances or {}), **{document_id(doc): score for doc, score in vector_results}}
+        fused = []
+        for doc, _ in reciprocal_rank_fusion([vector_results, lexical_results]):
+            distance = distances.get(document_id(doc))
+            if distance is None and _index_usable(index):
+                # Document trouvé par BM25 seulement : sa distance est lue dans l'index en mémoire
+                distance = index.document_distance(document_id(doc), query_embedding)
+            if distance is None:
+                # Distance inconnue : le document garde son rang fusionné, sans compter comme bonne correspondance
+                distance = SIMILARITY_THRESHOLD
+            fused.append((doc, distance))
+    # L'ordre fusionné départage les bonnes correspondances sans en faire perdre une
+    return sorted(fused, key=lambda item: item[1] >= SIMILARITY_THRESHOLD)
+
+def metadata_filter(focus_area: str = "", source: str = "") -> Optional[dict]:
+    """
+    Build a search filter on the indexed metadata columns from the non-empty values.
+
+    Returns:
+        dict | None: e.g. {"focus_area": "Glaucoma"}, or None when no value is given.
+    """
+    filter = {column: value for column, value in (("focus_area", focus_area), ("source", source)) if value}
+    return filter or None
+
+def matches_filter(doc: Document, filter: Optional[dict]) -> bool:
+    return not filter or all(doc.metadata.get(column) == value for column, value in filter.items())
+
+def _pg_filter(filter: Optional[dict]) -> dict:
+    # Filtre de PostgresVectorStore : une égalité par colonne indexée, traduite en WHERE
+    if not filter:
+        return {}
+    return {"filter": {column: {"$eq": value} for column, value in filter.items()}}
+
+def _index_usable(index: InMemoryVectorIndex) -> bool:
+    return index is not None and len(index) > 0 and not index.is_stale()
+
+def _best_document(results: list[tuple[Document, float]]) -> list[Document]:
     # Trier par score (plus petit score = plus grande similarité)
     sorted_results = sorted(results, key=lambda x: x[1])
     
@@ -28,6 +228,14 @@ def get_relevant_documents(query: str, vector_store: PostgresVectorStore) -> lis
     best_doc = sorted_results[0][0] if sorted_results else None
     return [best_doc] if best_doc else []
 
+def document_id(doc: Document) -> str:
+    """
+    Stable identifier of a medical_qa document: the table id, or the CSV row index as a fallback.
+    """
+    if getattr(doc, "id", None):
+        return str(doc.id)
+    return str(doc.metadata.get("row_index", doc.page_content))
+
 def format_relevant_documents(documents: list[Document]) -> str:
     """
     Format medical documents into a readable string.
@@ -66,7 +274,7 @@ def format_relevant_documents(documents: list[Document]) -> str:
 
 if __name__ == '__main__':
     engine = create_cloud_sql_database_connection()
-    embedding = get_embeddings()
+    embedding = get_cached_embeddings()
     vector_store = get_vector_store(engine, TABLE_NAME, embedding)
     
     test_query = "What is fever?"
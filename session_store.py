@@ -0,0 +1,280 @@
+"""
+Stockage borné des conversations, par session_id.
+
+Chaque backend plafonne le nombre de messages par session et le nombre de
+sessions, et expire les sessions inactives. Le backend SQLite (mode WAL)
+est partagé entre plusieurs workers uvicorn d'un même conteneur ; ses
+variantes asynchrones (aget_history, aappend...) s'exécutent dans un thread
+pour ne pas bloquer la boucle d'événements de l'API.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Surcoût approximatif d'un message (dict + chaînes) au-delà de son contenu
+_MESSAGE_OVERHEAD = 200
+_SESSION_OVERHEAD = 500
+
+
+def _message_size(message: dict) -> int:
+    return _MESSAGE_OVERHEAD + len(message["content"].encode("utf-8"))
+
+
+class _AsyncSessionMethods:
+    """
+    Variantes asynchrones des méthodes d'un stockage, pour l'API. Un stockage sur disque
+    (`blocking`) est appelé dans un thread, un stockage en mémoire directement.
+    """
+
+    blocking = False
+
+    async def _call(self, method, *args, **kwargs):
+        if self.blocking:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    async def aget_history(self, session_id: str) -> list[dict]:
+        return await self._call(self.get_history, session_id)
+
+    async def aappend(self, session_id: str, role: str, content: str):
+        await self._call(self.append, session_id, role, content)
+
+    async def aget_meta(self, session_id: str) -> dict:
+        return await self._call(self.get_meta, session_id)
+
+    async def aupdate_meta(self, session_id: str, **values):
+        await self._call(self.update_meta, session_id, **values)
+
+
+class MemorySessionStore(_AsyncSessionMethods):
+    """
+    Sessions en mémoire du processus, éviction LRU et par inactivité.
+
+    Args:
+        max_messages (int): Nombre maximal de messages gardés par session.
+        max_sessions (int): Nombre maximal de sessions, les moins récemment utilisées sont évincées.
+        idle_ttl (float): Durée d'inactivité en secondes après laquelle une session expire.
+    """
+
+    def __init__(self, max_messages: int = 20, max_sessions: int = 10000, idle_ttl: float = 3600):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+        self._sessions = OrderedDict()  # session_id -> {"messages", "meta", "last_access", "size"}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _touch(self, session_id: str) -> dict:
+        now = time.time()
+        session = self._sessions.get(session_id)
+        if session is not None and now - session["last_access"] > self.idle_ttl:
+            # Session expirée mais pas encore évincée : elle repart vide
+            self._bytes -= session["size"] - _SESSION_OVERHEAD
+            session.update(messages=[], meta={}, size=_SESSION_OVERHEAD)
+            self.evictions += 1
+        if session is None:
+            session = {"messages": [], "meta": {}, "last_access": now, "size": _SESSION_OVERHEAD}
+            self._sessions[session_id] = session
+            self._bytes += session["size"]
+        session["last_access"] = now
+        self._sessions.move_to_end(session_id)
+        self._evict(now)
+        return session
+
+    def _evict(self, now: float):
+        # L'ordre LRU est aussi l'ordre de dernière activité : les sessions expirées sont en tête
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session["last_access"] <= self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._bytes -= session["size"]
+            self.evictions += 1
+
+    def get_history(self, session_id: str) -> list[dict]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or time.time() - session["last_access"] > self.idle_ttl:
+                return []
+            return list(session["messages"])
+
+    def append(self, session_id: str, role: str, content: str):
+        message = {"role": role, "content": content}
+        with self._lock:
+            session = self._touch(session_id)
+            session["messages"].append(message)
+            added = _message_size(message)
+            while len(session["messages"]) > self.max_messages:
+                added -= _message_size(session["messages"].pop(0))
+            session["size"] += added
+            self._bytes += added
+
+    def get_meta(self, session_id: str) -> dict:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or time.time() - session["last_access"] > self.idle_ttl:
+                return {}
+            return dict(session["meta"])
+
+    def update_meta(self, session_id: str, **values):
+        with self._lock:
+            self._touch(session_id)["meta"].update(values)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": sum(len(session["messages"]) for session in self._sessions.values()),
+                "approx_bytes": self._bytes,
+                "evictions": self.evictions,
+            }
+
+
+class SQLiteSessionStore(_AsyncSessionMethods):
+    """
+    Sessions dans un fichier SQLite en mode WAL, partagé par les workers d'un conteneur.
+
+    Args:
+        path (str): Chemin du fichier SQLite.
+        max_messages (int): Nombre maximal de messages gardés par session.
+        max_sessions (int): Nombre maximal de sessions, les moins récemment utilisées sont évincées.
+        idle_ttl (float): Durée d'inactivité en secondes après laquelle une session expire.
+        cleanup_every (int): Nombre d'écritures entre deux passes d'éviction globales.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str = "sessions.sqlite3", max_messages: int = 20, max_sessions: int = 10000,
+                 idle_ttl: float = 3600, cleanup_every: int = 100):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.cleanup_every = cleanup_every
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, last_access REAL NOT NULL, meta TEXT NOT NULL DEFAULT '{}')"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+
+    def _touch(self, session_id: str):
+        now = time.time()
+        expired = self._conn.execute(
+            "SELECT 1 FROM sessions WHERE session_id = ? AND last_access < ?", (session_id, now - self.idle_ttl)
+        ).fetchone()
+        if expired:
+            # Session expirée mais pas encore évincée par la passe globale : elle repart vide
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("UPDATE sessions SET meta = '{}' WHERE session_id = ?", (session_id,))
+            self.evictions += 1
+        self._conn.execute(
+            "INSERT INTO sessions (session_id, last_access) VALUES (?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET last_access = excluded.last_access",
+            (session_id, now)
+        )
+        self._writes += 1
+        if self._writes % self.cleanup_every == 0:
+            self._evict()
+
+    def _evict(self):
+        expired = self._expired_sessions()
+        for i in range(0, len(expired), 500):
+            batch = expired[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM messages WHERE session_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM sessions WHERE session_id IN ({placeholders})", batch)
+        self.evictions += len(expired)
+
+    def _expired_sessions(self) -> list[str]:
+        idle = [row[0] for row in self._conn.execute(
+            "SELECT session_id FROM sessions WHERE last_access < ?", (time.time() - self.idle_ttl,)
+        )]
+        overflow = [row[0] for row in self._conn.execute(
+            "SELECT session_id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?", (self.max_sessions,)
+        )]
+        return list(set(idle) | set(overflow))
+
+    def get_history(self, session_id: str) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT m.role, m.content FROM messages m JOIN sessions s ON s.session_id = m.session_id "
+                "WHERE m.session_id = ? AND s.last_access >= ? ORDER BY m.id", (session_id, time.time() - self.idle_ttl)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def append(self, session_id: str, role: str, content: str):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._touch(session_id)
+                self._conn.execute(
+                    "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", (session_id, role, content)
+                )
+                self._conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND id NOT IN ("
+                    "SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                    (session_id, session_id, self.max_messages)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_meta(self, session_id: str) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT meta FROM sessions WHERE session_id = ? AND last_access >= ?", (session_id, time.time() - self.idle_ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def update_meta(self, session_id: str, **values):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._touch(session_id)
+                row = self._conn.execute("SELECT meta FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                meta = json.loads(row[0]) if row else {}
+                meta.update(values)
+                self._conn.execute("UPDATE sessions SET meta = ? WHERE session_id = ?", (json.dumps(meta), session_id))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            messages, content_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM messages").fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "messages": messages,
+            "approx_bytes": content_bytes + sessions * _SESSION_OVERHEAD + messages * _MESSAGE_OVERHEAD,
+            "evictions": self.evictions,
+        }
+
+
+def create_session_store(backend: str = "memory", path: str = "sessions.sqlite3", **limits):
+    """
+    Construit le stockage des sessions avec le backend choisi ("memory" ou "sqlite").
+    """
+    if backend == "memory":
+        return MemorySessionStore(**limits)
+    if backend == "sqlite":
+        return SQLiteSessionStore(path=path, **limits)
+    raise ValueError(f"Backend de sessions inconnu : {backend}")
@@ -0,0 +1,77 @@
+"""
+Regroupement des appels concurrents identiques (« single flight »).
+
+Pendant un pic, la même question arrive plusieurs fois au même instant : le
+premier appel d'une clé exécute le travail (embedding, recherche, LLM), les
+appels suivants de même clé attendent son résultat au lieu de solliciter à
+nouveau les services amont. Une erreur est transmise à tous les appels en
+attente ; le travail partagé n'est annulé que si plus aucun appel ne l'attend.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Appels en cours par clé, sur la boucle d'événements du worker.
+    """
+
+    def __init__(self):
+        self._calls = {}  # clé -> _Call
+        self.executions = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Résultat de `factory()` ; un appel de même clé déjà en cours est attendu au lieu d'être relancé.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.executions += 1
+        else:
+            self.shared += 1
+        call.waiters += 1
+        try:
+            # shield : l'annulation d'un appelant n'annule pas le travail attendu par les autres
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Plus personne n'attend le résultat : clé libérée tout de suite, un appel suivant
+                # relance le travail au lieu de rejoindre une tâche annulée
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+
+    def pending(self, key: Hashable) -> bool:
+        """
+        Un appel de cette clé est en cours : `do` l'attendrait au lieu de relancer le travail.
+        """
+        return key in self._calls
+
+    def _forget(self, key: Hashable, call: _Call):
+        # Clé libérée dès la fin : les appels suivants repassent par les caches, pas par ce résultat
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            call.task.exception()  # exception déjà transmise aux appelants : pas d'avertissement asyncio
+
+    def stats(self) -> dict:
+        total = self.executions + self.shared
+        return {
+            "executions": self.executions,
+            "shared": self.shared,
+            "shared_rate": self.shared / total if total else 0.0,
+            "in_flight": len(self._calls),
+        }
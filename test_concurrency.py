@@ -0,0 +1,193 @@
+"""
+Tests du regroupement des appels (single flight) et du contrôle d'admission de l'API,
+sur les doublures de fakes.py : `python -m pytest test_concurrency.py`.
+"""
+import asyncio
+import gc
+import os
+
+import pytest
+
+# ingest.py lit le mot de passe à l'import : inutile hors ligne
+os.environ.setdefault("DB_PASSWORD", "")
+
+import api
+from admission import AdmissionController
+from fakes import install_fakes
+from singleflight import SingleFlight
+
+OFF_CORPUS = "Quelle est la météo sur Mars ?"
+
+
+@pytest.fixture
+def fake_api():
+    """
+    API sur doublures, avec un regroupement et un contrôle d'admission neufs (une place, file vide).
+    """
+    saved = api.inflight, api.admission, api.question_index, api.lexical_index
+    fakes = install_fakes(api, embedding_latency=0.0, search_latency=0.0, llm_latency=0.2)
+    api.inflight = SingleFlight()
+    api.admission = AdmissionController(initial_limit=1, min_limit=1, max_limit=1, max_queue=0)
+    api.question_index = api.lexical_index = None
+    yield fakes
+    api.inflight, api.admission, api.question_index, api.lexical_index = saved
+
+
+def question(text: str = OFF_CORPUS) -> api.UserInput:
+    return api.UserInput(question=text, temperature=0.3, language="Francais")
+
+
+def test_leader_exception_reaches_every_waiter():
+    flight = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("panne amont")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("clé", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert not flight.pending("clé")
+
+
+def test_cancelled_waiter_leaves_shared_call_running():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "réponse"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("clé", work))
+        second = asyncio.ensure_future(flight.do("clé", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled()
+
+    result, cancelled = asyncio.run(run())
+    assert (result, cancelled) == ("réponse", True)
+    assert len(calls) == 1
+
+
+def test_last_waiter_cancelled_frees_the_key():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def run():
+        waiter = asyncio.ensure_future(flight.do("clé", work))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        # Aucun appel suivant ne rejoint la tâche annulée : le travail est relancé
+        assert not flight.pending("clé")
+        return await flight.do("clé", work)
+
+    assert asyncio.run(run()) == 2
+
+
+def test_full_queue_returns_503_with_retry_after(fake_api):
+    async def run():
+        busy = asyncio.ensure_future(api.answer(question()))
+        await asyncio.sleep(0.05)
+        rejected = await api.answer(question("Une autre question hors corpus ?"))
+        return rejected, await busy
+
+    rejected, served = asyncio.run(run())
+    assert rejected.status_code == 503
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert "error" not in served
+    assert api.admission.in_flight == 0
+
+
+def test_identical_requests_wait_on_one_call_and_keep_their_sessions(fake_api):
+    async def run():
+        return await asyncio.gather(*(api.answer(question()) for _ in range(4)))
+
+    responses = asyncio.run(run())
+    assert fake_api["llm"].calls == 1
+    # Une seule place : les trois autres requêtes attendent le calcul en cours au lieu d'en prendre une
+    assert api.admission.counters["admitted"] == 1
+    assert api.admission.counters["joined"] == 3
+    session_ids = {response["session_id"] for response in responses}
+    assert len(session_ids) == 4
+    for session_id in session_ids:
+        assert [message["role"] for message in api.session_store.get_history(session_id)] == ["user", "assistant"]
+
+
+def test_request_joining_during_generation_runs_no_upstream_call(fake_api):
+    async def run():
+        leader = asyncio.ensure_future(api.answer(question()))
+        await asyncio.sleep(0.05)  # recherche du premier terminée, appel LLM en cours
+        return await asyncio.gather(leader, api.answer(question()))
+
+    asyncio.run(run())
+    assert fake_api["embedding"].calls == 1
+    assert fake_api["llm"].calls == 1
+    assert api.admission.counters["joined"] == 1
+
+
+def test_identical_request_after_completion_takes_its_own_slot(fake_api):
+    async def run():
+        await api.answer(question())
+        await api.answer(question())
+
+    asyncio.run(run())
+    assert api.admission.counters["admitted"] == 2
+    assert api.admission.counters["joined"] == 0
+    assert api.admission.in_flight == 0
+
+
+def test_stream_slot_released_when_response_is_never_read(fake_api):
+    async def run():
+        response = await api.answer_stream(question())
+        held = api.admission.in_flight
+        del response
+        gc.collect()
+        await asyncio.sleep(0.01)
+        return held
+
+    assert asyncio.run(run()) == 1
+    assert api.admission.in_flight == 0
+
+
+def test_stream_rejected_before_any_event_when_full(fake_api):
+    async def run():
+        first = await api.answer_stream(question())
+        second = await api.answer_stream(question("Une autre question hors corpus ?"))
+        events = [event async for event in first.body_iterator]
+        return second, events
+
+    rejected, events = asyncio.run(run())
+    assert rejected.status_code == 503
+    assert '"type": "done"' in events[-1]
+    assert api.admission.in_flight == 0
+
+
+def test_batch_questions_go_through_admission(fake_api):
+    async def run():
+        partial = await api.answer_batch([question(f"Question hors corpus numéro {i} ?") for i in range(3)])
+        busy = asyncio.ensure_future(api.answer(question()))
+        await asyncio.sleep(0.05)
+        rejected = await api.answer_batch([question("Encore une question hors corpus ?")])
+        await busy
+        return partial, rejected
+
+    partial, rejected = asyncio.run(run())
+    results = partial["results"]
+    # Une seule place : une question servie, les deux autres refusées avec un délai de nouvel essai
+    assert sum("error" not in result for result in results) == 1
+    assert all(result["retry_after"] >= 1 for result in results if "error" in result)
+    assert rejected.status_code == 503
+    assert api.admission.in_flight == 0
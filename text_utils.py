@@ -0,0 +1,30 @@
+"""
+Normalisation des questions utilisée comme clé par les caches et les index.
+"""
+import re
+
+_WHITESPACE = re.compile(r"\s+")
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+def normalize_question(text: str) -> str:
+    """
+    Met la question en minuscules et réduit les espaces multiples.
+
+    Example:
+        >>> normalize_question("  What is (are)   Glaucoma ? ")
+        'what is (are) glaucoma ?'
+    """
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def fold_question(text: str) -> str:
+    """
+    Forme canonique d'une question pour la correspondance exacte : casse,
+    ponctuation et espaces repliés.
+
+    Example:
+        >>> fold_question("What is (are) Glaucoma ? ?")
+        'what is are glaucoma'
+    """
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", text)).strip().casefold()
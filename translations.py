@@ -0,0 +1,239 @@
+"""
+Réponses de référence de medical_qa pré-traduites hors ligne.
+
+Les traductions sont rangées dans medical_qa_translations (id du document,
+langue, réponse traduite, empreinte de la réponse d'origine) et servies par
+l'API selon l'id du document trouvé et la langue demandée : Gemini n'a plus
+à traduire la réponse de MedQuAD sur le chemin de la requête.
+
+Le job est reprenable : chaque traduction est écrite dès qu'elle est obtenue,
+les couples (document, langue) déjà traduits sont ignorés au lancement suivant
+et une réponse d'origine modifiée depuis est retraduite.
+
+Usage :
+    python translations.py translate --languages fr ar --concurrency 8
+    python translations.py translate --limit 500
+    python translations.py status
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from langchain_core.documents.base import Document
+
+from ingest import afetch_documents, create_cloud_sql_database_connection_async, create_local_database_connection
+from retrieve import document_id
+from config import TABLE_NAME, TRANSLATIONS_TABLE, TRANSLATION_LANGUAGES, TRANSLATION_CONCURRENCY, LANGUAGE_CODES
+
+# Nom de la langue donné au prompt de traduction
+LANGUAGE_NAMES = {"en": "anglais", "fr": "français", "ar": "arabe"}
+
+Translator = Callable[[str, str], Awaitable[str]]
+
+
+def normalize_language(language: str) -> str:
+    """
+    Code de langue ("fr", "ar", "en") d'un libellé de l'interface ; un libellé inconnu est gardé tel quel.
+    """
+    language = language.strip().casefold()
+    return LANGUAGE_CODES.get(language, language)
+
+
+def answer_hash(answer: str) -> str:
+    return hashlib.sha256(answer.encode("utf-8")).hexdigest()[:16]
+
+
+def gateway_translator(gateway) -> Translator:
+    """
+    Traducteur qui passe par la passerelle LLM (délai, nouvelles tentatives, disjoncteur).
+    """
+    async def translate(answer: str, language: str) -> str:
+        translation = await gateway.ainvoke("translation", 0.0, {
+            "language": LANGUAGE_NAMES.get(language, language),
+            "text": answer
+        })
+        return translation.strip()
+    return translate
+
+
+class TranslationStore:
+    """
+    Table de hachage (id du document, code de langue) -> réponse traduite.
+
+    Args:
+        translations (dict): Les traductions, par (id du document, code de langue).
+    """
+
+    def __init__(self, translations: Dict[Tuple[str, str], str]):
+        self._translations = translations
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    async def aload(cls, engine, table_name: str = TRANSLATIONS_TABLE) -> "TranslationStore":
+        async with engine._pool.connect() as conn:
+            result = await conn.execute(text(f'SELECT doc_id, language, answer FROM "{table_name}"'))
+            return cls({(row["doc_id"], row["language"]): row["answer"] for row in result.mappings()})
+
+    def __len__(self) -> int:
+        return len(self._translations)
+
+    def get(self, doc_id: str, language: str) -> Optional[str]:
+        answer = self._translations.get((doc_id, language))
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def languages(self) -> Dict[str, int]:
+        counts = {}
+        for _, language in self._translations:
+            counts[language] = counts.get(language, 0) + 1
+        return counts
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "translations": self.languages(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+async def ensure_translations_table(engine, table_name: str = TRANSLATIONS_TABLE):
+    async with engine._pool.connect() as conn:
+        await conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{table_name}" ('
+            'doc_id TEXT NOT NULL, language TEXT NOT NULL, answer TEXT NOT NULL, answer_hash TEXT NOT NULL, '
+            'PRIMARY KEY (doc_id, language))'
+        ))
+        await conn.commit()
+
+
+async def afetch_translation_hashes(engine, table_name: str = TRANSLATIONS_TABLE) -> Dict[Tuple[str, str], str]:
+    async with engine._pool.connect() as conn:
+        result = await conn.execute(text(f'SELECT doc_id, language, answer_hash FROM "{table_name}"'))
+        return {(row["doc_id"], row["language"]): row["answer_hash"] for row in result.mappings()}
+
+
+def table_writer(engine, table_name: str = TRANSLATIONS_TABLE) -> Callable[[str, str, str, str], Awaitable[None]]:
+    """
+    Écrit (ou remplace) une traduction ; chaque écriture est validée aussitôt pour la reprise.
+    """
+    async def write(doc_id: str, language: str, translation: str, source_hash: str):
+        async with engine._pool.connect() as conn:
+            await conn.execute(text(
+                f'INSERT INTO "{table_name}" (doc_id, language, answer, answer_hash) '
+                'VALUES (:doc_id, :language, :answer, :answer_hash) '
+                'ON CONFLICT (doc_id, language) DO UPDATE SET answer = EXCLUDED.answer, answer_hash = EXCLUDED.answer_hash'
+            ), {"doc_id": doc_id, "language": language, "answer": translation, "answer_hash": source_hash})
+            await conn.commit()
+    return write
+
+
+async def translate_answers(documents: List[Document], translator: Translator, write: Callable[[str, str, str, str], Awaitable[None]],
+                            languages: List[str] = TRANSLATION_LANGUAGES, done: Dict[Tuple[str, str], str] = None,
+                            concurrency: int = TRANSLATION_CONCURRENCY, limit: int = None) -> dict:
+    """
+    Traduit les réponses de référence qui ne le sont pas encore (ou dont l'original a changé),
+    au plus `concurrency` à la fois. Une traduction en échec est comptée et reprise au lancement suivant.
+
+    Args:
+        done (dict): Empreintes des traductions existantes, par (id du document, langue).
+        limit (int): Nombre maximal de traductions pour ce lancement.
+
+    Returns:
+        dict: traductions faites, déjà à jour, en échec et débit en traductions par seconde.
+    """
+    done = done or {}
+    pending = []
+    for doc in documents:
+        source_hash = answer_hash(doc.metadata["answer"])
+        for language in languages:
+            if done.get((document_id(doc), language)) != source_hash:
+                pending.append((doc, language, source_hash))
+    stats = {"translated": 0, "up_to_date": len(documents) * len(languages) - len(pending), "failed": 0}
+    if limit is not None:
+        pending = pending[:limit]
+
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    async def translate_one(doc: Document, language: str, source_hash: str):
+        async with semaphore:
+            try:
+                translation = await translator(doc.metadata["answer"], language)
+                await write(document_id(doc), language, translation, source_hash)
+                stats["translated"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"Erreur de traduction ({document_id(doc)}, {language}): {str(e)}")
+            if (stats["translated"] + stats["failed"]) % 100 == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{stats['translated']} traductions, {stats['failed']} échecs "
+                      f"({stats['translated'] / elapsed:.1f} traductions/s)")
+
+    await asyncio.gather(*(translate_one(*item) for item in pending))
+    stats["translations_per_second"] = stats["translated"] / max(time.perf_counter() - start, 1e-9)
+    return stats
+
+
+async def atranslate_table(engine, translator: Translator, source_table: str = TABLE_NAME,
+                           table_name: str = TRANSLATIONS_TABLE, **kwargs) -> dict:
+    """
+    Traduit les réponses de `source_table` dans `table_name` (créée si besoin), en reprenant là où le dernier lancement s'est arrêté.
+    """
+    await ensure_translations_table(engine, table_name)
+    documents = await afetch_documents(engine, source_table)
+    done = await afetch_translation_hashes(engine, table_name)
+    return await translate_answers(documents, translator, table_writer(engine, table_name), done=done, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Traduction hors ligne des réponses de référence de medical_qa")
+    parser.add_argument("--database-url", help="PostgreSQL local (postgresql+asyncpg://...) au lieu de Cloud SQL")
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--translations-table", default=TRANSLATIONS_TABLE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    translate = subparsers.add_parser("translate", help="Traduire les réponses manquantes ou modifiées")
+    translate.add_argument("--languages", nargs="+", default=TRANSLATION_LANGUAGES)
+    translate.add_argument("--concurrency", type=int, default=TRANSLATION_CONCURRENCY)
+    translate.add_argument("--limit", type=int, help="Nombre maximal de traductions pour ce lancement")
+    subparsers.add_parser("status", help="Nombre de traductions par langue")
+
+    args = parser.parse_args()
+
+    async def run():
+        if args.database_url:
+            engine = create_local_database_connection(args.database_url)
+        else:
+            engine = await create_cloud_sql_database_connection_async()
+
+        if args.command == "status":
+            await ensure_translations_table(engine, args.translations_table)
+            store = await TranslationStore.aload(engine, args.translations_table)
+            for language, count in sorted(store.languages().items()):
+                print(f"{language} : {count} réponses traduites")
+            if not len(store):
+                print(f"Aucune traduction dans {args.translations_table}")
+        else:
+            from api import llm_gateway  # import local : l'API dépend de ce module
+            stats = await atranslate_table(
+                engine, gateway_translator(llm_gateway), source_table=args.table, table_name=args.translations_table,
+                languages=[normalize_language(language) for language in args.languages],
+                concurrency=args.concurrency, limit=args.limit
+            )
+            print(f"{stats['translated']} réponses traduites, {stats['up_to_date']} déjà à jour, {stats['failed']} échecs "
+                  f"({stats['translations_per_second']:.2f} traductions/s)")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
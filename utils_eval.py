@@ -11,6 +11,24 @@ def cosine_similarity_texts(text1: str, text2: str) -> float:
     tfidf_matrix = vectorizer.fit_transform([text1, text2])
     return cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0]
 
+class CorpusScorer:
+    """
+    Vectoriseur TF-IDF ajusté une seule fois sur tout le corpus de réponses :
+    les poids IDF sont les mêmes pour toutes les paires comparées.
+    """
+
+    def __init__(self, corpus):
+        self.vectorizer = TfidfVectorizer().fit(corpus)
+
+    def score_pairs(self, texts, references) -> np.ndarray:
+        """
+        Similarité cosinus de chaque texte avec la référence de même rang, en une opération creuse.
+        """
+        # Les lignes TF-IDF sont normalisées (L2) : le cosinus est la somme du produit terme à terme
+        a = self.vectorizer.transform(texts)
+        b = self.vectorizer.transform(references)
+        return np.asarray(a.multiply(b).sum(axis=1)).ravel()
+
 def calculate_relevance(chatbot_response, true_answer):
     if not chatbot_response:
         return 0.0
@@ -23,6 +41,33 @@ def calculate_relevance(chatbot_response, true_answer):
     else:
         return cosine_similarity_texts(chatbot_response.get('response', ''), true_answer)
 
+def calculate_relevance_batch(chatbot_responses, true_answers, scorer: CorpusScorer) -> np.ndarray:
+    """
+    Même métrique que `calculate_relevance` pour toutes les réponses à la fois, avec un vectoriseur commun.
+    """
+    combined = np.array([bool(r) and r.get('type') == 'combined_response' for r in chatbot_responses])
+    # combined_response : comparée à la réponse de référence en base ; sinon à la vraie réponse
+    references = [r['db_answer'] if is_combined else answer
+                  for r, answer, is_combined in zip(chatbot_responses, true_answers, combined)]
+    texts = [r.get('response', '') if r else '' for r in chatbot_responses]
+    similarities = scorer.score_pairs(texts, references)
+    scores = np.array([float(r['score']) if is_combined else 0.0 for r, is_combined in zip(chatbot_responses, combined)])
+    relevance = np.where(combined, (similarities + (1 - scores)) / 2, similarities)
+    missing = np.array([not r for r in chatbot_responses])
+    return np.where(missing, 0.0, relevance)
+
+def retrieval_metrics(ranks) -> dict:
+    """
+    Recall@1, recall@4 et MRR à partir du rang (1 = premier) du bon document, None s'il n'est pas trouvé.
+    """
+    ranks = np.array([rank if rank is not None else 0 for rank in ranks])
+    found = ranks > 0
+    return {
+        "recall@1": float(np.mean(ranks == 1)),
+        "recall@4": float(np.mean(found & (ranks <= 4))),
+        "mrr": float(np.mean(np.where(found, 1.0 / np.maximum(ranks, 1), 0.0))),
+    }
+
 def was_answer_found_in_db(chatbot_response):
     """
     Vérifie si une réponse a été trouvée dans la base de données
@@ -47,7 +92,7 @@ def display_evaluation_results(results):
     """
     Affiche les résultats de l'évaluation
     """
-    print("\nRésultats de l'évaluation sur 10 exemples aléatoires :")
+    print(f"\nRésultats de l'évaluation sur {len(results)} exemples aléatoires :")
     print("-" * 50)
     
     # Calcul des moyennes
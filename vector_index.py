@@ -0,0 +1,110 @@
+"""
+Index vectoriel en mémoire sur les embeddings de medical_qa.
+
+Recherche exacte par produit matriciel NumPy, avec la même distance que
+PostgresVectorStore (distance cosinus, plus petit = plus similaire) : le seuil
+de 0.2 utilisé par l'API garde donc la même signification.
+"""
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents.base import Document
+
+from ingest import afetch_documents_with_embeddings
+
+
+class InMemoryVectorIndex:
+    """
+    Matrice des embeddings normalisés et documents associés, dans le processus.
+
+    Args:
+        documents (list[Document]): Les documents, dans l'ordre des lignes de la matrice.
+        embeddings (list[list[float]]): Les vecteurs des documents.
+        max_age (float, optional): Âge en secondes au-delà duquel l'index est périmé.
+    """
+
+    def __init__(self, documents: List[Document], embeddings, max_age: Optional[float] = None):
+        self.documents = documents
+        self.max_age = max_age
+        self.loaded_at = time.time()
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(documents), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._matrix = matrix / norms
+        self._partitions = {}
+        self._rows = None  # id du document -> ligne, construit à la première demande
+
+    @classmethod
+    async def aload(cls, engine, table_name: str, max_age: Optional[float] = None) -> "InMemoryVectorIndex":
+        """
+        Charge tous les vecteurs de la table en une seule requête.
+        """
+        rows = await afetch_documents_with_embeddings(engine, table_name)
+        return cls([doc for doc, _ in rows], [vector for _, vector in rows], max_age=max_age)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def is_stale(self) -> bool:
+        return self.max_age is not None and time.time() - self.loaded_at > self.max_age
+
+    def distances(self, embedding: List[float]) -> np.ndarray:
+        """
+        Distance cosinus entre la requête et chaque document de l'index.
+        """
+        return _distances(self._matrix, embedding)
+
+    def document_distance(self, doc_id: str, embedding: List[float]) -> Optional[float]:
+        """
+        Distance cosinus entre la requête et un document donné par son id (None s'il est absent).
+        """
+        if self._rows is None:
+            self._rows = {str(doc.id): i for i, doc in enumerate(self.documents)}
+        row = self._rows.get(doc_id)
+        if row is None:
+            return None
+        return float(_distances(self._matrix[row:row + 1], embedding)[0])
+
+    def partition(self, filter: Dict[str, str]) -> np.ndarray:
+        """
+        Lignes dont les métadonnées valent `filter` (ex. {"focus_area": "Glaucoma"}), calculées une fois par filtre.
+        """
+        key = tuple(sorted(filter.items()))
+        rows = self._partitions.get(key)
+        if rows is None:
+            rows = np.array([i for i, doc in enumerate(self.documents)
+                             if all(doc.metadata.get(column) == value for column, value in filter.items())], dtype=np.int64)
+            self._partitions[key] = rows
+        return rows
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, str]] = None) -> List[tuple]:
+        if filter:
+            # Recherche restreinte à la partition : seules ses lignes de la matrice sont multipliées
+            rows = self.partition(filter)
+            if len(rows) == 0:
+                return []
+            distances = _distances(self._matrix[rows], embedding)
+        else:
+            if not self.documents:
+                return []
+            rows = None
+            distances = self.distances(embedding)
+        k = min(k, len(distances))
+        # Sélection partielle des k plus proches, puis tri de ces k seulement
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [(self.documents[i if rows is None else rows[i]], float(distances[i])) for i in top]
+
+    async def asimilarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                                      filter: Optional[Dict[str, str]] = None) -> List[tuple]:
+        return self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+
+
+def _distances(matrix: np.ndarray, embedding: List[float]) -> np.ndarray:
+    query = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm == 0:
+        return np.ones(len(matrix), dtype=np.float32)
+    return 1.0 - matrix @ (query / norm)